@@ -11,7 +11,7 @@ from dotenv import load_dotenv
 
 # Module Imports
 from docqna.HTMLTemplates import css
-from docqna.stcomp import initialize_session_state, file_processing, handle_user_input
+from docqna.stcomp import initialize_session_state, file_processing, handle_user_input, select_collection, select_query_mode
 # Load environment variables
 load_dotenv(dotenv_path="../.env", verbose=True)
 load_dotenv(dotenv_path="./.env", verbose=True)
@@ -58,6 +58,11 @@ def main() -> None:
 
     # The sidebar for the user to input the document
     with st.sidebar:
+        # The collection the documents are uploaded to and queried from
+        st.subheader(body="Collection")
+        select_collection()
+        select_query_mode()
+
         # The message for the user
         st.subheader(body="Upload Your Documents")
         # The element that allows user to upload PDFs from the user
@@ -1 +1 @@
-from .chat import get_conversation_engine
+from .chat import get_conversation_engine, get_retrieval_kwargs
@@ -1,33 +1,84 @@
+import toml
+from pathlib import Path
+from typing import Optional
+
 from llama_index.core.indices.base import BaseIndex
-from llama_index.vector_stores.redis import RedisVectorStore
+from llama_index.core.vector_stores.types import BasePydanticVectorStore
 from llama_index.core import VectorStoreIndex
+from llama_index.core.llms import LLM
+from llama_index.core.memory.types import BaseMemory
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 
+from ..postprocess import get_postprocessors
+from ..collection import get_collection_filters
+from ..memory import get_chat_memory
+
+
+# Get the directory of the current file and construct path to config.toml
+current_dir = Path(__file__).parent
+config_path = current_dir / '..' / '..' / '..' / 'config.toml'
+with open(config_path, 'r') as f:
+    params = toml.load(f)
+
+
+def get_retrieval_kwargs(embed_model: HuggingFaceEmbedding, collection: Optional[str] = None) -> dict:
+    """
+    Return the retrieval arguments shared by the chat engines and the retrievers.
+
+    Args:
+    - embed_model (HuggingFaceEmbedding): The embedding model used by the post-retrieval stages
+    - collection (Optional[str]): The collection to restrict the retrieval to, or None to search every collection
+
+    Returns:
+    - dict: The `node_postprocessors`, and the `similarity_top_k` and `filters` if they apply
+    """
+
+    # Get the post-retrieval stages (empty if disabled in the config)
+    node_postprocessors = get_postprocessors(embed_model)
+    retrieval_kwargs = {'node_postprocessors': node_postprocessors}
+    if node_postprocessors:
+        retrieval_kwargs['similarity_top_k'] = params['postprocess']['similarity_top_k']
+    if collection is not None:
+        retrieval_kwargs['filters'] = get_collection_filters(collection)
+
+    return retrieval_kwargs
+
+
 
 def get_conversation_engine(embed_model: HuggingFaceEmbedding, 
-                           vector_store: RedisVectorStore) -> BaseIndex.as_chat_engine:
+                           vector_store: BasePydanticVectorStore,
+                           collection: Optional[str] = None,
+                           llm: Optional[LLM] = None,
+                           memory: Optional[BaseMemory] = None) -> BaseIndex.as_chat_engine:
     """
     
     Initialize and return a Chat engine using the provided embed model and vector store.
 
     Args:
     - embed_model (HuggingFaceEmbedding): An embedding model from Hugging Face to generate embeddings of the query
-    - vector store (RedisVectorStore): The vector store to access from the Redis Database that was generated from the pipeline
+    - vector store (BasePydanticVectorStore): The vector store of the storage backend that was generated from the pipeline
+    - collection (Optional[str]): The collection to restrict the retrieval to, or None to search every collection
+    - llm (Optional[LLM]): The language model to use, or None for the default one
+    - memory (Optional[BaseMemory]): The memory of the conversation, or None for a new one from `get_chat_memory`
     
     Returns:
-    - Chat Engine: An initialized LLama Index Chat Engine with the provided Redis database, a ChatOpenAI language model, and a Conversation Memory.
+    - Chat Engine: An initialized LLama Index Chat Engine with the provided vector store, a ChatOpenAI language model, and a Conversation Memory.
 
     Notes:
     - The ChatOpenAI language model is used as the default LLM.
     - Chat Engine also does the task of keeping track of previous messages 
+    - If post-processing is enabled, `similarity_top_k` nodes are over-retrieved, reranked with a
+      cross-encoder and compressed to the relevant sentences before being passed to the LLM.
+    - The collection is applied as a pre-filter on the indexed `collection` tag, so only its vectors are searched.
+    - The chat history passed to the LLM is limited to a token budget, with an optional running summary of the
+      older turns, so the prompt size stays flat over long conversations.
     """
 
-
     # Obtain the index or the type of model you want to use
     chat_engine = VectorStoreIndex.from_vector_store(
         vector_store, embed_model=embed_model
-    ).as_chat_engine()
+    ).as_chat_engine(llm=llm, memory=memory or get_chat_memory(llm), **get_retrieval_kwargs(embed_model, collection))
 
 
     # Return the llama index chat_engine 
-    return chat_engine
+    return chat_engine
\ No newline at end of file
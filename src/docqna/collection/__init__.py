@@ -0,0 +1 @@
+from .collection import list_collections, validate_collection_name, create_collection, get_collection_stats, update_collection_stats, tag_documents, get_collection_filters
@@ -0,0 +1,131 @@
+import re
+import toml
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from llama_index.core import Document
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores import ExactMatchFilter, MetadataFilters
+
+from ..pipeline import get_kvstore
+
+
+# Get the directory of the current file and construct path to config.toml
+current_dir = Path(__file__).parent
+config_path = current_dir / '..' / '..' / '..' / 'config.toml'
+with open(config_path, 'r') as f:
+    params = toml.load(f)
+
+# Collection names end up in docstore namespaces and Redis tag queries, so keep them simple
+COLLECTION_NAME_PATTERN = r'^[A-Za-z0-9_-]{1,64}$'
+
+
+
+def _empty_stats() -> dict:
+    return {"documents": 0, "nodes": 0, "sources": [], "updated": None}
+
+
+
+def list_collections() -> list[str]:
+    """
+    Return the names of all the collections in the registry, the default collection always included.
+    """
+    names = set(get_kvstore().get_all(collection=params['collections']['registry_name']))
+    names.add(params['collections']['default'])
+    return sorted(names)
+
+
+
+def validate_collection_name(name: str) -> str:
+    """
+    Return the name if it is a valid collection name.
+
+    Raises:
+    - ValueError: If the name is not made of 1 to 64 letters, digits, `_` and `-`
+    """
+    if not isinstance(name, str) or not re.match(COLLECTION_NAME_PATTERN, name):
+        raise ValueError(f"Invalid collection name '{name}'. Use letters, digits, '_' and '-' only.")
+    return name
+
+
+
+def create_collection(name: str) -> None:
+    """
+    Register a new, empty collection.
+
+    Args:
+    - name (str): The name of the collection, made of letters, digits, `_` and `-`
+
+    Raises:
+    - ValueError: If the name is not a valid collection name
+    """
+    validate_collection_name(name)
+
+    kvstore = get_kvstore()
+    registry = params['collections']['registry_name']
+    if kvstore.get(name, collection=registry) is None:
+        kvstore.put(name, _empty_stats(), collection=registry)
+
+
+
+def get_collection_stats(name: str) -> dict:
+    """
+    Return the stats of a collection: number of documents, number of nodes, source files and last update time.
+    """
+    return get_kvstore().get(name, collection=params['collections']['registry_name']) or _empty_stats()
+
+
+
+def update_collection_stats(name: str, nodes: list[TextNode]) -> dict:
+    """
+    Add the freshly ingested nodes to the stats of a collection.
+
+    Args:
+    - name (str): The name of the collection
+    - nodes (list[TextNode]): The nodes that were ingested in the collection
+
+    Returns:
+    - dict: The updated stats of the collection
+    """
+    stats = get_collection_stats(name)
+    sources = set(stats['sources'])
+    new_sources = {node.metadata['source'] for node in nodes if 'source' in node.metadata}
+
+    stats['documents'] += len(new_sources - sources)
+    stats['nodes'] += len(nodes)
+    stats['sources'] = sorted(sources | new_sources)
+    stats['updated'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+    get_kvstore().put(name, stats, collection=params['collections']['registry_name'])
+    return stats
+
+
+
+def tag_documents(documents: list[Document], name: str) -> list[Document]:
+    """
+    Tag the documents with their collection, so every node split from them carries the tag into the vector store.
+
+    Notes:
+    - The tag is excluded from the embedding and LLM text, it is only used for filtering.
+    """
+    for document in documents:
+        document.metadata['collection'] = name
+        for excluded_keys in (document.excluded_embed_metadata_keys, document.excluded_llm_metadata_keys):
+            if 'collection' not in excluded_keys:
+                excluded_keys.append('collection')
+    return documents
+
+
+
+def get_collection_filters(name: str, source: Optional[str] = None) -> MetadataFilters:
+    """
+    Return the metadata filters that restrict a retrieval to a single collection, and optionally to one of its sources.
+
+    Raises:
+    - ValueError: If the name is not a valid collection name, as it ends up in the tag query
+    """
+    filters = [ExactMatchFilter(key='collection', value=validate_collection_name(name))]
+    if source is not None:
+        filters.append(ExactMatchFilter(key='source', value=source))
+    return MetadataFilters(filters=filters)
@@ -0,0 +1 @@
+from .dedupe import BoilerplateStripper, NearDuplicateFilter, register_dedupe_nodes, forget_dedupe_documents, DEDUPE_STATS
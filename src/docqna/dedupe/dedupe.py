@@ -0,0 +1,302 @@
+import base64
+import re
+import threading
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode, Document, TransformComponent
+from llama_index.core.storage.kvstore.types import BaseKVStore
+
+# A page of the text extracted by `get_pdf_text`, between its two page number markers
+PAGE_PATTERN = re.compile(r'\n PAGE_NUM=(\d+) \n (.*?) \n PAGE_NUM=\1 \n', re.DOTALL)
+PAGE_NUM_MARKER = re.compile(r'PAGE_NUM=\d+')
+
+# Mersenne prime of the MinHash permutations, small enough for the products to fit in 64 bits
+MINHASH_PRIME = (1 << 31) - 1
+# The permutations must stay the same across runs, the signatures are persisted
+MINHASH_SEED = 20240311
+
+# Counts added to the `stats` of the calls of the components
+DEDUPE_STATS = ['boilerplate_lines', 'boilerplate_chars', 'duplicate_nodes', 'duplicate_chars']
+
+
+
+def _normalize_line(line: str) -> str:
+    # Page numbers and dates change from page to page, the rest of a header or footer doesn't
+    return re.sub(r'\d+', '#', re.sub(r'\s+', ' ', line)).strip().lower()
+
+
+
+class BoilerplateStripper(TransformComponent):
+    """
+    Strip the lines repeated on many pages of a document, such as headers, footers, disclaimers and revision tables.
+
+    Notes:
+    - A line is boilerplate if it appears on at least `min_pages` pages and `min_page_ratio` of the pages of the
+      document, ignoring whitespace and digits (page numbers, dates), and has at least `min_letters` letters.
+      Short repeated lines such as table headers, units or "Yes" / "N/A" cells are content, not boilerplate.
+    - The first occurrence of every boilerplate line is kept, so its content can still be retrieved once.
+    - The page number markers are kept, so page tracking is unaffected. Documents without markers are left as is.
+    - It runs on Documents, before the splitter. The lines and characters stripped are added to the `stats` Counter
+      passed to the call, if any.
+    """
+
+    min_pages: int = 3
+    min_page_ratio: float = 0.5
+    min_letters: int = 8
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BoilerplateStripper"
+
+    def _strip(self, text: str) -> tuple[str, int, int]:
+        pages = PAGE_PATTERN.findall(text)
+        if len(pages) < self.min_pages:
+            return text, 0, 0
+
+        # Number of pages every line appears on
+        counts = Counter()
+        for _, content in pages:
+            counts.update({_normalize_line(line) for line in content.split('\n')} - {''})
+        min_count = max(self.min_pages, self.min_page_ratio * len(pages))
+        boilerplate = {
+            line for line, count in counts.items()
+            if count >= min_count and sum(char.isalpha() for char in line) >= self.min_letters
+        }
+        if not boilerplate:
+            return text, 0, 0
+
+        seen, removed = set(), [0, 0]
+
+        def strip_page(match: re.Match) -> str:
+            kept = []
+            for line in match.group(2).split('\n'):
+                normalized = _normalize_line(line)
+                if normalized in boilerplate and normalized in seen:
+                    removed[0] += 1
+                    removed[1] += len(line)
+                    continue
+                seen.add(normalized)
+                kept.append(line)
+            page_num = match.group(1)
+            return f'\n PAGE_NUM={page_num} \n ' + '\n'.join(kept) + f' \n PAGE_NUM={page_num} \n'
+
+        return PAGE_PATTERN.sub(strip_page, text), removed[0], removed[1]
+
+    def __call__(self, nodes: List[BaseNode], stats: Optional[Counter] = None, **kwargs: Any) -> List[BaseNode]:
+        stripped_nodes = []
+        for node in nodes:
+            if not isinstance(node, Document):
+                stripped_nodes.append(node)
+                continue
+            text, lines, chars = self._strip(node.text)
+            if lines:
+                node = node.copy()
+                node.text = text
+                if stats is not None:
+                    stats['boilerplate_lines'] += lines
+                    stats['boilerplate_chars'] += chars
+            stripped_nodes.append(node)
+        return stripped_nodes
+
+
+
+class NearDuplicateFilter(TransformComponent):
+    """
+    Drop the chunks that are near-duplicates of a chunk of another document of the collection, or of an earlier
+    chunk of the same document, before they are embedded.
+
+    Notes:
+    - Chunks are compared by the Jaccard similarity of their word shingles, estimated with MinHash signatures
+      of `num_perm` permutations. Candidates are found with an LSH index of `bands` bands, and dropped if their
+      estimated similarity is at least `threshold`.
+    - The page number markers are ignored, so the same disclaimer on two different pages is a duplicate.
+    - The LSH index of a collection is kept in the KV store and loaded in memory the first time it is used. Chunks
+      are only added to it by `register`, once they are in the vector store, so a chunk is never dropped as a
+      duplicate of a chunk that may still fail to ingest. A call also matches the earlier chunks of its own input.
+    - `forget` removes the chunks of the documents that failed to ingest or were deleted from the docstore. Chunks
+      of the same document from earlier runs are never matched.
+    - It runs on nodes, after the splitter and before the embedding model. The chunks and characters dropped are
+      added to the `stats` Counter passed to the call, if any.
+    """
+
+    collection: str
+    index_name: str
+    shingle_size: int = 5
+    num_perm: int = 64
+    bands: int = 16
+    threshold: float = 0.85
+
+    _kvstore: BaseKVStore = PrivateAttr()
+    _perm_a: np.ndarray = PrivateAttr()
+    _perm_b: np.ndarray = PrivateAttr()
+    _buckets: Optional[Dict[tuple, list]] = PrivateAttr(default=None)
+    _signatures: Dict[str, tuple] = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, kvstore: BaseKVStore, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        if self.num_perm % self.bands:
+            raise ValueError(f"num_perm ({self.num_perm}) must be a multiple of bands ({self.bands}).")
+        self._kvstore = kvstore
+        rng = np.random.default_rng(MINHASH_SEED)
+        self._perm_a = rng.integers(1, MINHASH_PRIME, size=self.num_perm, dtype=np.uint64)
+        self._perm_b = rng.integers(0, MINHASH_PRIME, size=self.num_perm, dtype=np.uint64)
+        self._signatures = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NearDuplicateFilter"
+
+    @property
+    def _kv_collection(self) -> str:
+        return f"{self.index_name}_{self.collection}"
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """
+        Return the MinHash signature of a text, or None if it has no words.
+        """
+        words = re.findall(r'\w+', PAGE_NUM_MARKER.sub(' ', text).lower())
+        if not words:
+            return None
+        size = min(self.shingle_size, len(words))
+        shingles = {' '.join(words[idx:idx + size]) for idx in range(len(words) - size + 1)}
+        hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64) % MINHASH_PRIME
+        permuted = (self._perm_a[:, None] * hashes[None, :] + self._perm_b[:, None]) % MINHASH_PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray) -> List[int]:
+        return [zlib.crc32(band.tobytes()) for band in signature.reshape(self.bands, -1)]
+
+    def _add(self, node_id: str, doc_id: Optional[str], signature: np.ndarray, band_keys: Sequence[int]) -> None:
+        self._signatures[node_id] = (doc_id, signature)
+        for band, key in enumerate(band_keys):
+            self._buckets.setdefault((band, key), []).append(node_id)
+
+    def _is_duplicate(self, signature: np.ndarray, candidate_signature: np.ndarray) -> bool:
+        return np.mean(candidate_signature == signature) >= self.threshold
+
+    def _remove(self, node_id: str) -> None:
+        _, signature = self._signatures.pop(node_id)
+        for band, key in enumerate(self._band_keys(signature)):
+            bucket = self._buckets.get((band, key), [])
+            if node_id in bucket:
+                bucket.remove(node_id)
+            if not bucket:
+                self._buckets.pop((band, key), None)
+
+    def _load(self) -> None:
+        # Load the index of the collection once per process
+        self._buckets = {}
+        for node_id, entry in self._kvstore.get_all(collection=self._kv_collection).items():
+            signature = np.frombuffer(base64.b64decode(entry['sig']), dtype=np.uint32)
+            self._add(node_id, entry['doc'], signature, entry['bands'])
+
+    def _find_duplicate(self, doc_id: Optional[str], signature: np.ndarray, band_keys: Sequence[int],
+                        batch: Dict[tuple, list]) -> Optional[str]:
+        candidates, batch_candidates = set(), []
+        for band, key in enumerate(band_keys):
+            candidates.update(self._buckets.get((band, key), []))
+            batch_candidates.extend(batch.get((band, key), []))
+        for candidate in candidates:
+            candidate_doc_id, candidate_signature = self._signatures[candidate]
+            if candidate_doc_id == doc_id:
+                # A chunk of an earlier run of the same document
+                continue
+            if self._is_duplicate(signature, candidate_signature):
+                return candidate
+        for candidate, candidate_signature in batch_candidates:
+            if self._is_duplicate(signature, candidate_signature):
+                return candidate
+        return None
+
+    def __call__(self, nodes: List[BaseNode], stats: Optional[Counter] = None, **kwargs: Any) -> List[BaseNode]:
+        # The kept chunks of this call, by band, matched by the following ones but not by other calls
+        kept, batch = [], {}
+        with self._lock:
+            if self._buckets is None:
+                self._load()
+
+            for node in nodes:
+                signature = self.signature(node.get_content())
+                if signature is None:
+                    kept.append(node)
+                    continue
+                band_keys = self._band_keys(signature)
+                if self._find_duplicate(node.ref_doc_id, signature, band_keys, batch) is not None:
+                    if stats is not None:
+                        stats['duplicate_nodes'] += 1
+                        stats['duplicate_chars'] += len(node.get_content())
+                    continue
+
+                for band, key in enumerate(band_keys):
+                    batch.setdefault((band, key), []).append((node.node_id, signature))
+                kept.append(node)
+
+        return kept
+
+    def register(self, nodes: List[BaseNode]) -> None:
+        """
+        Add the nodes added to the vector store to the index, in memory and in the KV store.
+        """
+        entries = []
+        with self._lock:
+            if self._buckets is None:
+                self._load()
+            for node in nodes:
+                if node.node_id in self._signatures:
+                    continue
+                signature = self.signature(node.get_content())
+                if signature is None:
+                    continue
+                band_keys = self._band_keys(signature)
+                self._add(node.node_id, node.ref_doc_id, signature, band_keys)
+                entries.append((node.node_id, {
+                    'doc': node.ref_doc_id,
+                    'bands': band_keys,
+                    'sig': base64.b64encode(signature.tobytes()).decode(),
+                }))
+
+        if entries:
+            self._kvstore.put_all(entries, collection=self._kv_collection)
+
+    def forget(self, doc_ids: Sequence[str]) -> None:
+        """
+        Remove the chunks of the documents from the index, in memory and in the KV store.
+        """
+        doc_ids = set(doc_ids)
+        with self._lock:
+            if self._buckets is None:
+                self._load()
+            node_ids = [node_id for node_id, (doc_id, _) in self._signatures.items() if doc_id in doc_ids]
+            for node_id in node_ids:
+                self._remove(node_id)
+
+        for node_id in node_ids:
+            self._kvstore.delete(node_id, collection=self._kv_collection)
+
+
+
+def register_dedupe_nodes(transformations: List[TransformComponent], nodes: List[BaseNode]) -> None:
+    """
+    Register the nodes added to the vector store in the near-duplicate filters of a list of transformations.
+    """
+    for transformation in transformations:
+        if isinstance(transformation, NearDuplicateFilter):
+            transformation.register(nodes)
+
+
+
+def forget_dedupe_documents(transformations: List[TransformComponent], doc_ids: Sequence[str]) -> None:
+    """
+    Remove the documents from the near-duplicate filters of a list of transformations.
+    """
+    for transformation in transformations:
+        if isinstance(transformation, NearDuplicateFilter):
+            transformation.forget(doc_ids)
+
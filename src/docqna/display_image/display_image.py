@@ -1,28 +1,48 @@
 import fitz
-from PIL import Image
+import os
 import re
-import streamlit as st
-def show_image(file_path,page_num):
+
+from ..page_store import get_page_store, PAGE_SIZES
+
+
+def show_image(file_path, page_num, size="preview", file_hash=None):
+    """
+    Return the image of a page of a PDF file.
+
+    Args:
+    - file_path (str): The path of the PDF file
+    - page_num (int): The page number, starting at 1
+    - size (str): "preview" for display or "full" for download
+    - file_hash (str): The `file_hash` metadata of the node, the content hash of the PDF in the page image store
+
+    Returns:
+    - tuple: The image bytes, a file name for the download and the mime type of the image
+
+    Notes:
+    - Pages pre-rendered at ingestion are read from the page image store, by the content hash of their PDF.
+    - Other pages are rendered on demand in memory, nothing is written next to the source file.
+    """
     pattern = r'\.pdf$|\.txt$'
     # Use re.sub() to replace the matched pattern with an empty string
-    cleaned_filename = re.sub(pattern, '', file_path)
-
-    # Opening the PDF file and creating a handle for it
-    file_handle = fitz.open(file_path)
+    cleaned_filename = re.sub(pattern, '', os.path.basename(file_path))
 
-    # The index within the square brackets is the page number
-    page = file_handle[page_num-1]
+    # Read the pre-rendered page if there is one
+    page_store = get_page_store()
+    if page_store is not None and file_hash is not None:
+        image = page_store.get_page(file_hash, page_num, size)
+        if image is not None:
+            return image, f"{cleaned_filename}_{page_num}.{page_store.image_format.lower()}", page_store.mime
 
-    # Obtaining the pixelmap of the page
-    page_img = page.get_pixmap()
+    # Opening the PDF file and creating a handle for it
+    with fitz.open(file_path) as file_handle:
+        # The index within the square brackets is the page number
+        page = file_handle[page_num-1]
 
-    # Saving the pixelmap into a png image file
-    image_path = f"{cleaned_filename}_{page_num}.png"
-    page_img.save(image_path)
+        # Obtaining the pixelmap of the page
+        page_img = page.get_pixmap(dpi=PAGE_SIZES[size])
 
-    # Reading the PNG image file using pillow
-    img = Image.open(image_path)
-    return img, image_path
+    # Encoding the pixelmap as a png image
+    return page_img.tobytes("png"), f"{cleaned_filename}_{page_num}.png", "image/png"
    
 
 # show_image(r"D:\vscode\DocQnA_v3\data\ASMV-ADNOC OFFSHORE-2019.pdf",7)
\ No newline at end of file
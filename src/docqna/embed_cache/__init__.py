@@ -0,0 +1 @@
+from .embed_cache import EmbeddingStore, CachedEmbedding, get_cached_embed_model, embedding_key
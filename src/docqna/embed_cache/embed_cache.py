@@ -0,0 +1,255 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+import toml
+import unicodedata
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, List, Optional
+
+import numpy as np
+import streamlit as st
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+
+# Get the directory of the current file and construct path to config.toml
+current_dir = Path(__file__).parent
+config_path = current_dir / '..' / '..' / '..' / 'config.toml'
+with open(config_path, 'r') as f:
+    params = toml.load(f)
+
+# Size of the keys (truncated sha256 digests) in the key file
+KEY_SIZE = 16
+
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize a text before hashing, so whitespace and unicode variants of the same text share an embedding.
+    """
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+
+
+
+def embedding_key(model_id: str, text: str) -> bytes:
+    """
+    Return the cache key of the embedding of a text by a model.
+    """
+    return hashlib.sha256(f"{model_id}\0{normalize_text(text)}".encode()).digest()[:KEY_SIZE]
+
+
+
+class EmbeddingStore:
+    """
+    Persistent, content-addressed store of the embeddings of one model.
+
+    Layout:
+    - `vectors.f32`: The embeddings as one contiguous float32 matrix, memory-mapped for reading.
+    - `keys.bin`: The key of every row of the matrix, in the same order. It is loaded in a dict for O(1) lookups.
+    - `meta.json`: The model id and the dimension of the embeddings.
+
+    Notes:
+    - Rows are written to the matrix before their key is appended, under a file lock, so a key always points
+      to a complete row and several processes can share the store.
+    - The row of a key is its position in the key file. A partial key left by a crashed writer is truncated
+      before the next append, so the keys that follow it stay aligned with their rows.
+    - Entries added by other processes are picked up the next time a key is missing.
+    """
+
+    def __init__(self, root: str, model_id: str) -> None:
+        self.model_id = model_id
+        self.root = Path(root) / hashlib.sha256(model_id.encode()).hexdigest()[:16]
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.keys_path = self.root / 'keys.bin'
+        self.vectors_path = self.root / 'vectors.f32'
+        self.meta_path = self.root / 'meta.json'
+        self.keys_path.touch(exist_ok=True)
+        self.vectors_path.touch(exist_ok=True)
+
+        self.dim = None
+        self._rows = {}
+        self._keys_offset = 0
+        self._vectors = None
+        self._lock = threading.Lock()
+        self._refresh()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _refresh(self) -> None:
+        # Only read the complete keys appended since the last refresh
+        with open(self.keys_path, 'rb') as f:
+            f.seek(self._keys_offset)
+            data = f.read()
+        data = data[:len(data) - len(data) % KEY_SIZE]
+        for offset in range(0, len(data), KEY_SIZE):
+            # A key written twice keeps its first row
+            self._rows.setdefault(data[offset:offset + KEY_SIZE], (self._keys_offset + offset) // KEY_SIZE)
+        self._keys_offset += len(data)
+        # The store may have been created by another process since this one opened it. The meta file is written
+        # before the first key, so it is there as soon as a key was read
+        if self.dim is None and self.meta_path.exists():
+            self.dim = json.loads(self.meta_path.read_text())['dim']
+
+    def _matrix(self) -> np.ndarray:
+        # Remap the vectors when other rows were added
+        n_rows = self._keys_offset // KEY_SIZE
+        if self._vectors is None or self._vectors.shape[0] < n_rows:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(n_rows, self.dim))
+        return self._vectors
+
+    def get(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        """
+        Return the embedding of every key, or None for the keys that are not in the store.
+        """
+        with self._lock:
+            if any(key not in self._rows for key in keys):
+                self._refresh()
+            if not self._rows:
+                return [None] * len(keys)
+            matrix = self._matrix()
+            return [np.array(matrix[self._rows[key]]) if key in self._rows else None for key in keys]
+
+    def put(self, keys: List[bytes], vectors: List[List[float]]) -> None:
+        """
+        Add the embeddings of the keys that are not in the store yet.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock, open(self.keys_path, 'ab') as keys_file:
+            fcntl.flock(keys_file, fcntl.LOCK_EX)
+            try:
+                # Drop the partial key of a writer that crashed mid-append, its row is overwritten below
+                size = os.fstat(keys_file.fileno()).st_size
+                if size % KEY_SIZE:
+                    os.ftruncate(keys_file.fileno(), size - size % KEY_SIZE)
+                self._refresh()
+                if self.dim is None:
+                    self.dim = vectors.shape[1]
+                    tmp_path = self.meta_path.with_suffix(f".{os.getpid()}.tmp")
+                    tmp_path.write_text(json.dumps({'model_id': self.model_id, 'dim': self.dim}))
+                    os.replace(tmp_path, self.meta_path)
+                elif vectors.shape[1] != self.dim:
+                    raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the store ({self.dim}).")
+
+                new_rows = {}
+                for key, vector in zip(keys, vectors):
+                    if key not in self._rows and key not in new_rows:
+                        new_rows[key] = vector
+                if not new_rows:
+                    return
+
+                first_row = self._keys_offset // KEY_SIZE
+                with open(self.vectors_path, 'r+b') as vectors_file:
+                    vectors_file.seek(first_row * self.dim * 4)
+                    vectors_file.write(np.stack(list(new_rows.values())).tobytes())
+                keys_file.write(b''.join(new_rows))
+                keys_file.flush()
+
+                for row, key in enumerate(new_rows, start=first_row):
+                    self._rows[key] = row
+                self._keys_offset += len(new_rows) * KEY_SIZE
+            finally:
+                fcntl.flock(keys_file, fcntl.LOCK_UN)
+
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Embedding model that reads the text embeddings from an `EmbeddingStore` and only computes the missing ones.
+
+    Notes:
+    - Queries are passed straight to the wrapped model.
+    - The hits and misses of the text embeddings made in a thread can be counted, see `count`.
+    """
+
+    _embed_model: HuggingFaceEmbedding = PrivateAttr()
+    _store: EmbeddingStore = PrivateAttr()
+    _local: threading.local = PrivateAttr()
+
+    def __init__(self, embed_model: HuggingFaceEmbedding, store: EmbeddingStore, **kwargs: Any) -> None:
+        super().__init__(model_name=embed_model.model_name, **kwargs)
+        self._embed_model = embed_model
+        self._store = store
+        self._local = threading.local()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @contextmanager
+    def count(self, stats: Counter) -> Iterator[Counter]:
+        """
+        Add the `hits` and `misses` of the text embeddings made by the current thread in the block to `stats`.
+
+        Notes:
+        - The counts are per thread, so concurrent ingestions sharing the model each count their own embeddings,
+          including the ones made by the splitter.
+        """
+        previous = getattr(self._local, 'stats', None)
+        self._local.stats = stats
+        try:
+            yield stats
+        finally:
+            self._local.stats = previous
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed_model.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._embed_model.aget_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_key(self._store.model_id, text) for text in texts]
+        embeddings = self._store.get(keys)
+        missing = [idx for idx, embedding in enumerate(embeddings) if embedding is None]
+
+        if missing:
+            new_embeddings = self._embed_model.get_text_embedding_batch([texts[idx] for idx in missing])
+            self._store.put([keys[idx] for idx in missing], new_embeddings)
+            for idx, embedding in zip(missing, new_embeddings):
+                embeddings[idx] = embedding
+
+        stats = getattr(self._local, 'stats', None)
+        if stats is not None:
+            stats['hits'] += len(texts) - len(missing)
+            stats['misses'] += len(missing)
+
+        return [list(map(float, embedding)) for embedding in embeddings]
+
+
+
+@st.cache_resource
+def get_cached_embed_model(_embed_model: HuggingFaceEmbedding) -> BaseEmbedding:
+    """
+    Wrap the embedding model with the persistent embedding cache, or return it as is if the cache is disabled.
+
+    Args:
+    - _embed_model (HuggingFaceEmbedding): The embedding model to wrap
+
+    Returns:
+    - BaseEmbedding: The embedding model to use for ingestion
+
+    Notes:
+    - The cache is keyed by the model name and the hash of the normalized text, so it is shared by every
+      pipeline, splitter and collection using the same model.
+    """
+    config = params['embed_cache']
+    if not config['enabled']:
+        return _embed_model
+
+    return CachedEmbedding(
+        _embed_model,
+        EmbeddingStore(config['store_path'], _embed_model.model_name),
+        # Look up large batches in the store, the misses are embedded with the batch size of the model
+        embed_batch_size=config['lookup_batch_size'],
+    )
@@ -0,0 +1 @@
+from .evaluation import load_questions, run_evaluation, is_hit
@@ -0,0 +1,36 @@
+import argparse
+import asyncio
+import json
+
+from .evaluation import load_questions, run_evaluation
+
+
+def main() -> None:
+    """
+    Run a batch evaluation of a JSONL file of questions, e.g. from ./src:
+
+        python -m docqna.evaluation questions.jsonl --llm stub --output results.jsonl
+    """
+    parser = argparse.ArgumentParser(prog="python -m docqna.evaluation", description="Run a batch question evaluation.")
+    parser.add_argument("questions", help="JSONL file with a `question` per line, and optional `expected_sources`, `expected_pages` and `collection`")
+    parser.add_argument("--collection", default=None, help="Collection of the questions that don't set one")
+    parser.add_argument("--llm", choices=["stub", "openai"], default="stub", help="LLM used for the generation")
+    parser.add_argument("--concurrency", type=int, default=8, help="Questions retrieved and generated at once")
+    parser.add_argument("--embed-batch-size", type=int, default=32, help="Queries embedded per forward pass")
+    parser.add_argument("--output", default=None, help="JSONL file to write the result of every question to")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions, args.collection)
+    report = asyncio.run(run_evaluation(
+        questions, llm=args.llm, concurrency=args.concurrency, embed_batch_size=args.embed_batch_size
+    ))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            for result in report['results']:
+                f.write(json.dumps(result) + '\n')
+    print(json.dumps(report['summary'], indent=2))
+
+
+if __name__ == "__main__":
+    main()
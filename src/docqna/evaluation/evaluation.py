@@ -0,0 +1,194 @@
+import asyncio
+import json
+import time
+import toml
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from llama_index.core import VectorStoreIndex, get_response_synthesizer
+from llama_index.core.callbacks import CallbackManager, TokenCountingHandler
+from llama_index.core.llms import LLM
+from llama_index.core.llms.mock import MockLLM
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.utils import get_tokenizer
+
+from ..chat import get_retrieval_kwargs
+from ..pdf_ingest import get_page_num
+from ..pipeline import embed_queries, get_embed_model, get_vector_store
+
+
+# Get the directory of the current file and construct path to config.toml
+current_dir = Path(__file__).parent
+config_path = current_dir / '..' / '..' / '..' / 'config.toml'
+with open(config_path, 'r') as f:
+    params = toml.load(f)
+
+PERCENTILES = [50, 90, 95, 99]
+
+
+
+def load_questions(path: str, collection: Optional[str] = None) -> list[dict]:
+    """
+    Load the questions of a JSONL file.
+
+    Notes:
+    - Every line holds a `question`, and optionally the `expected_sources` (file names), the `expected_pages`
+      and the `collection` to ask it in. The collection defaults to the given one, then to the default collection.
+    """
+    questions = []
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            question = json.loads(line)
+            question.setdefault('collection', collection or params['collections']['default'])
+            questions.append(question)
+    return questions
+
+
+
+def is_hit(question: dict, nodes: list[NodeWithScore]) -> Optional[bool]:
+    """
+    Return whether a retrieved node matches the expected sources and pages of a question, or None without expectations.
+    """
+    expected_sources = set(question.get('expected_sources') or [])
+    expected_pages = set(question.get('expected_pages') or [])
+    if not expected_sources and not expected_pages:
+        return None
+
+    for node in nodes:
+        if expected_sources and node.node.metadata.get('source') not in expected_sources:
+            continue
+        if expected_pages and not expected_pages & set(get_page_num(node.node.get_content())):
+            continue
+        return True
+    return False
+
+
+
+def _percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    return {f"p{p}": round(float(np.percentile(values, p)), 4) for p in PERCENTILES}
+
+
+
+def _get_llm(name: str, token_counter: TokenCountingHandler) -> LLM:
+    callback_manager = CallbackManager([token_counter])
+    if name == 'stub':
+        return MockLLM(max_tokens=64, callback_manager=callback_manager)
+
+    from llama_index.llms.openai import OpenAI
+    return OpenAI(model=params['service']['llm_model'], max_retries=3, callback_manager=callback_manager)
+
+
+
+async def _answer(question: dict, embedding: list[float], synthesizer, retrievers: dict,
+                  slots: asyncio.Semaphore, tokenizer) -> dict:
+    query_bundle = QueryBundle(query_str=question['question'], embedding=embedding)
+    retriever, node_postprocessors = retrievers[question['collection']]
+
+    async with slots:
+        t0 = time.perf_counter()
+
+        def retrieve() -> list[NodeWithScore]:
+            nodes = retriever.retrieve(query_bundle)
+            for postprocessor in node_postprocessors:
+                nodes = postprocessor.postprocess_nodes(nodes, query_bundle=query_bundle)
+            return nodes
+
+        try:
+            nodes = await asyncio.to_thread(retrieve)
+            t1 = time.perf_counter()
+            response = await synthesizer.asynthesize(question['question'], nodes)
+            t2 = time.perf_counter()
+        except Exception as e:
+            # Keep the results of the other questions
+            return {**question, 'error': f"{type(e).__name__}: {e}", 'total_seconds': time.perf_counter() - t0}
+
+    return {
+        **question,
+        'answer': str(response),
+        'sources': [{'source': node.node.metadata.get('source'), 'score': node.score} for node in nodes],
+        'hit': is_hit(question, nodes),
+        'context_tokens': sum(len(tokenizer(node.node.get_content())) for node in nodes),
+        'retrieval_seconds': t1 - t0,
+        'generation_seconds': t2 - t1,
+        'total_seconds': t2 - t0,
+        'error': None,
+    }
+
+
+
+async def run_evaluation(questions: list[dict], llm: str = 'stub', concurrency: int = 8,
+                         embed_batch_size: int = 32) -> dict:
+    """
+    Answer a batch of questions against the index and report latency, retrieval hit rate and token usage.
+
+    Args:
+    - questions (list[dict]): The questions, see `load_questions`
+    - llm (str): "stub" for a mock LLM that makes no API call, or "openai" for the configured OpenAI model
+    - concurrency (int): The maximum number of questions retrieved and generated at once
+    - embed_batch_size (int): The number of queries embedded per forward pass
+
+    Returns:
+    - dict: The `summary` of the run and the `results` of every question
+
+    Notes:
+    - All the queries are embedded first, in batches, then retrieval and generation run concurrently.
+    - Latencies are per question and exclude the query embedding, whose throughput is reported separately.
+    - Token usage is counted on the LLM calls; `context_tokens` is the size of the retrieved context per question.
+    - A question that fails (e.g. an LLM timeout) gets its `error` in its result, and is left out of the latencies,
+      hit rate and context tokens of the summary.
+    """
+    embed_model = get_embed_model()
+    tokenizer = get_tokenizer()
+    token_counter = TokenCountingHandler()
+    synthesizer = get_response_synthesizer(llm=_get_llm(llm, token_counter), use_async=True)
+
+    # Embed every query in batches
+    t0 = time.perf_counter()
+    embeddings = []
+    for start in range(0, len(questions), embed_batch_size):
+        batch = [question['question'] for question in questions[start:start + embed_batch_size]]
+        embeddings.extend(embed_queries(embed_model, batch))
+    embed_seconds = time.perf_counter() - t0
+
+    # One retriever per collection
+    index = VectorStoreIndex.from_vector_store(get_vector_store(), embed_model=embed_model)
+    retrievers = {}
+    for collection in {question['collection'] for question in questions}:
+        retrieval_kwargs = get_retrieval_kwargs(embed_model, collection)
+        node_postprocessors = retrieval_kwargs.pop('node_postprocessors')
+        retrievers[collection] = (index.as_retriever(**retrieval_kwargs), node_postprocessors)
+
+    t1 = time.perf_counter()
+    slots = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(*(
+        _answer(question, embedding, synthesizer, retrievers, slots, tokenizer)
+        for question, embedding in zip(questions, embeddings)
+    ))
+    wall_seconds = time.perf_counter() - t1
+
+    answered = [result for result in results if result['error'] is None]
+    hits = [result['hit'] for result in answered if result['hit'] is not None]
+    summary = {
+        'questions': len(results),
+        'errors': len(results) - len(answered),
+        'llm': llm,
+        'concurrency': concurrency,
+        'embedding_seconds': round(embed_seconds, 4),
+        'queries_embedded_per_second': round(len(questions) / embed_seconds, 2) if embed_seconds else None,
+        'wall_seconds': round(wall_seconds, 4),
+        'total_latency': _percentiles([result['total_seconds'] for result in answered]),
+        'retrieval_latency': _percentiles([result['retrieval_seconds'] for result in answered]),
+        'generation_latency': _percentiles([result['generation_seconds'] for result in answered]),
+        'hit_rate': round(sum(hits) / len(hits), 4) if hits else None,
+        'questions_with_expectations': len(hits),
+        'prompt_tokens': token_counter.prompt_llm_token_count,
+        'completion_tokens': token_counter.completion_llm_token_count,
+        'mean_context_tokens': round(float(np.mean([result['context_tokens'] for result in answered])), 1) if answered else 0,
+    }
+    return {'summary': summary, 'results': results}
@@ -0,0 +1 @@
+from .ingest import StagedIngestion, ingest_files, STAGES
@@ -0,0 +1,252 @@
+import queue
+import threading
+import time
+import toml
+from collections import Counter
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from llama_index.core.ingestion.pipeline import run_transformations
+
+from ..collection import tag_documents
+from ..dedupe import DEDUPE_STATS, BoilerplateStripper, NearDuplicateFilter, forget_dedupe_documents, register_dedupe_nodes
+from ..embed_cache import CachedEmbedding
+from ..pdf_ingest import extract_saved_document, save_document
+from ..pipeline import get_pipeline
+
+
+# Get the directory of the current file and construct path to config.toml
+current_dir = Path(__file__).parent
+config_path = current_dir / '..' / '..' / '..' / 'config.toml'
+with open(config_path, 'r') as f:
+    params = toml.load(f)
+
+# Stages of the ingestion, in order
+STAGES = ["save", "extract", "split", "embed", "store"]
+
+# Marks the end of the input of a stage
+_DONE = object()
+
+# A stage without workers, or a queue without room, would leave the batch waiting forever
+for key in [f"{stage}_workers" for stage in STAGES] + ['queue_size']:
+    value = params['ingest'][key]
+    if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+        raise ValueError(f"[ingest] {key} must be an integer of at least 1, got {value!r}.")
+
+
+
+class StagedIngestion:
+    """
+    Ingestion of a batch of files through stages connected by bounded queues, so the files overlap across stages.
+
+    Stages:
+    - save: Save the upload under the data path, and convert DOCX and TXT files to PDF.
+    - extract: Extract the text of the PDF (with OCR if it has none), and tag the documents with the collection.
+    - split: Skip the documents already in the docstore of the collection, and split the others into nodes.
+    - embed: Embed the nodes.
+    - store: Add the nodes to the vector store.
+
+    Notes:
+    - The split stage strips the boilerplate and drops the near-duplicate nodes if dedupe is enabled, see `get_pipeline`.
+    - Every stage has its own worker threads (`[ingest]` in the config), and at most `queue_size` files wait
+      between two stages, so a batch takes roughly the time of its slowest stage.
+    - The split and embed stages run the transformations of the collection pipeline with its ingestion cache,
+      and the documents are deduplicated on the docstore like `IngestionPipeline` does with DUPLICATES_ONLY.
+      The dedupe components run without the cache: the near-duplicate filter depends on the chunks already stored,
+      not only on its input, and the text stripped by both is counted in every batch.
+    - The boilerplate, near-duplicate and embedding cache counts are kept per file in `job['stats']`, so batches
+      running at the same time don't count each other's work.
+    - Workers never call Streamlit: every progress update is queued and handed to `on_event` in the calling thread.
+    - A file failing in a stage is dropped from the following ones, and removed from the docstore and the near-duplicate
+      index so it can be retried. Stored nodes are registered in the near-duplicate index by the store stage.
+    """
+
+    def __init__(self, collection: str) -> None:
+        self.collection = collection
+        self.pipeline = get_pipeline(collection)['pipeline']
+        self.config = params['ingest']
+        self._events = queue.Queue()
+        self._busy = {stage: 0.0 for stage in STAGES}
+        self._lock = threading.Lock()
+        # Hashes of the documents added by this batch, so the same document in two files is only ingested once
+        self._batch_hashes = set()
+
+    def _notify(self, job: dict, stage: str, status: str, message: str = "", **data: Any) -> None:
+        self._events.put({'file': job['name'], 'stage': stage, 'status': status, 'message': message, **data})
+
+    def _counting(self, job: dict):
+        # Count the embedding cache hits of the thread, the splitter embeds too
+        embed_model = self.pipeline.transformations[-1]
+        if isinstance(embed_model, CachedEmbedding):
+            return embed_model.count(job['stats'])
+        return nullcontext()
+
+    def _save(self, job: dict) -> Optional[dict]:
+        job['pdf_path'] = save_document(job['file'], lambda message: self._notify(job, 'save', 'warning', message))
+        if job['pdf_path'] is None:
+            raise ValueError("The file could not be converted to PDF.")
+        return job
+
+    def _extract(self, job: dict) -> Optional[dict]:
+        documents = extract_saved_document(
+            job['file'], job['pdf_path'], lambda message: self._notify(job, 'extract', 'warning', message)
+        )
+        if not documents or documents[0].text == 'Error':
+            raise ValueError("No text could be extracted.")
+        job['documents'] = tag_documents(documents, self.collection)
+        return job
+
+    def _split(self, job: dict) -> Optional[dict]:
+        docstore = self.pipeline.docstore
+        with self._lock:
+            existing_hashes = docstore.get_all_document_hashes()
+            new_documents = []
+            for document in job['documents']:
+                if document.hash not in existing_hashes and document.hash not in self._batch_hashes:
+                    docstore.set_document_hash(document.id_, document.hash)
+                    self._batch_hashes.add(document.hash)
+                    new_documents.append(document)
+            docstore.add_documents(new_documents)
+
+        job['tracked'] = new_documents
+        if not new_documents:
+            self._notify(job, 'split', 'skipped', "Already ingested.")
+            return None
+
+        # Every transformation but the embedding model, which is the last one
+        nodes = new_documents
+        with self._counting(job):
+            for transformation in self.pipeline.transformations[:-1]:
+                dedupe = isinstance(transformation, (BoilerplateStripper, NearDuplicateFilter))
+                cache = None if dedupe else self.pipeline.cache
+                nodes = run_transformations(nodes, [transformation], cache=cache, stats=job['stats'])
+        job['nodes'] = nodes
+        return job
+
+    def _embed(self, job: dict) -> Optional[dict]:
+        with self._counting(job):
+            job['nodes'] = run_transformations(
+                job['nodes'], self.pipeline.transformations[-1:], cache=self.pipeline.cache
+            )
+        return job
+
+    def _store(self, job: dict) -> Optional[dict]:
+        nodes = [node for node in job['nodes'] if node.embedding is not None]
+        self.pipeline.vector_store.add(nodes)
+        register_dedupe_nodes(self.pipeline.transformations, nodes)
+        self._notify(job, 'store', 'done', nodes=job['nodes'], stats=job['stats'])
+        return job
+
+    def _worker(self, stage: str, in_queue: queue.Queue, out_queue: Optional[queue.Queue],
+                state: dict, next_workers: int) -> None:
+        process = getattr(self, f"_{stage}")
+        while True:
+            job = in_queue.get()
+            if job is _DONE:
+                with self._lock:
+                    state['running'] -= 1
+                    last = state['running'] == 0
+                # The last worker of a stage closes the next one
+                if last:
+                    if out_queue is not None:
+                        for _ in range(next_workers):
+                            out_queue.put(_DONE)
+                    else:
+                        self._events.put(_DONE)
+                return
+
+            t0 = time.perf_counter()
+            try:
+                job = process(job)
+            except Exception as e:
+                # Let the documents be ingested again, and their chunks be kept again
+                for document in job.get('tracked', []):
+                    self.pipeline.docstore.delete_document(document.id_, raise_error=False)
+                forget_dedupe_documents(
+                    self.pipeline.transformations, [document.id_ for document in job.get('tracked', [])]
+                )
+                self._notify(job, stage, 'failed', f"{type(e).__name__}: {e}")
+                job = None
+            with self._lock:
+                self._busy[stage] += time.perf_counter() - t0
+
+            if job is not None and out_queue is not None:
+                out_queue.put(job)
+
+    def run(self, files: list[Any], on_event: Optional[Callable[[dict], Any]] = None) -> dict:
+        """
+        Ingest the files, and return a report of the batch.
+
+        Args:
+        - files (list[Any]): The uploaded PDF, DOCX or TXT files, with a `name` attribute
+        - on_event (Optional[Callable[[dict], Any]]): Called in the calling thread with every `file`, `stage`,
+          `status` ("warning", "skipped", "failed" or "done") and `message` reported by the stages
+
+        Returns:
+        - dict: The ingested `nodes`, the `files` ingested, skipped and failed, the busy seconds of every stage,
+          the wall-clock seconds, the boilerplate and near-duplicate text skipped and the embedding cache hits
+          of the files ingested
+        """
+        t0 = time.perf_counter()
+
+        workers = [self.config[f"{stage}_workers"] for stage in STAGES]
+        queues = [queue.Queue(maxsize=self.config['queue_size']) for _ in STAGES]
+        threads = []
+        for idx, stage in enumerate(STAGES):
+            out_queue = queues[idx + 1] if idx + 1 < len(STAGES) else None
+            next_workers = workers[idx + 1] if idx + 1 < len(STAGES) else 0
+            state = {'running': workers[idx]}
+            for _ in range(workers[idx]):
+                threads.append(threading.Thread(
+                    target=self._worker, args=(stage, queues[idx], out_queue, state, next_workers),
+                    name=f"ingest-{stage}", daemon=True,
+                ))
+        for thread in threads:
+            thread.start()
+
+        def feed() -> None:
+            for file in files:
+                queues[0].put({'file': file, 'name': file.name, 'stats': Counter()})
+            for _ in range(workers[0]):
+                queues[0].put(_DONE)
+        threading.Thread(target=feed, name="ingest-feed", daemon=True).start()
+
+        nodes, done, skipped, failed = [], [], [], {}
+        stats = Counter()
+        while True:
+            event = self._events.get()
+            if event is _DONE:
+                break
+            if event['status'] == 'done':
+                nodes.extend(event.pop('nodes'))
+                stats.update(event.pop('stats'))
+                done.append(event['file'])
+            elif event['status'] == 'skipped':
+                skipped.append(event['file'])
+            elif event['status'] == 'failed':
+                failed[event['file']] = event['message']
+            if on_event is not None:
+                on_event(event)
+
+        report = {
+            'nodes': nodes,
+            'ingested': done,
+            'skipped': skipped,
+            'failed': failed,
+            'stage_seconds': {stage: round(seconds, 2) for stage, seconds in self._busy.items()},
+            'seconds': round(time.perf_counter() - t0, 2),
+        }
+        if params['dedupe']['enabled']:
+            report['dedupe'] = {key: stats[key] for key in DEDUPE_STATS}
+        if isinstance(self.pipeline.transformations[-1], CachedEmbedding):
+            report['embed_cache'] = {'hits': stats['hits'], 'misses': stats['misses']}
+        return report
+
+
+
+def ingest_files(files: list[Any], collection: str, on_event: Optional[Callable[[dict], Any]] = None) -> dict:
+    """
+    Ingest a batch of uploaded files in a collection with a `StagedIngestion`, and return its report.
+    """
+    return StagedIngestion(collection).run(files, on_event)
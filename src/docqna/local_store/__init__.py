@@ -0,0 +1 @@
+from .local_store import LocalVectorStore, SQLiteKVStore
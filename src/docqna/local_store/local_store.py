@@ -0,0 +1,482 @@
+import fcntl
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.kvstore.types import DEFAULT_BATCH_SIZE, DEFAULT_COLLECTION, BaseKVStore
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+
+try:
+    import hnswlib
+except ImportError:
+    # The local backend falls back to exact search for every corpus size
+    hnswlib = None
+
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+    # Readers never block the writer, and the other way around
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+
+class SQLiteKVStore(BaseKVStore):
+    """
+    KV store in a single SQLite file, used by the local backend for the docstores, the ingestion cache and the
+    collection registry.
+
+    Notes:
+    - Every collection is a set of rows of the same table, the values are stored as JSON.
+    - The file can be shared by several processes, SQLite serializes the writes.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._conn = _connect(Path(path))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (collection TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (collection, key))"
+        )
+        self._lock = threading.Lock()
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put_all([(key, val)], collection=collection)
+
+    async def aput(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put(key, val, collection=collection)
+
+    def put_all(self, kv_pairs: List[tuple], collection: str = DEFAULT_COLLECTION,
+                batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+        rows = [(collection, key, json.dumps(val)) for key, val in kv_pairs]
+        with self._lock:
+            # One transaction for the whole batch
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany("INSERT OR REPLACE INTO kv (collection, key, value) VALUES (?, ?, ?)", rows)
+
+    async def aput_all(self, kv_pairs: List[tuple], collection: str = DEFAULT_COLLECTION,
+                       batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+        self.put_all(kv_pairs, collection=collection, batch_size=batch_size)
+
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM kv WHERE collection = ? AND key = ?", (collection, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def aget(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        return self.get(key, collection=collection)
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT key, value FROM kv WHERE collection = ?", (collection,)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        return self.get_all(collection=collection)
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM kv WHERE collection = ? AND key = ?", (collection, key))
+        return cursor.rowcount > 0
+
+    async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return self.delete(key, collection=collection)
+
+
+
+class LocalVectorStore(BasePydanticVectorStore):
+    """
+    In-process vector store kept in a folder, used by the local backend instead of Redis.
+
+    Layout:
+    - `vectors.f32`: The normalized embeddings as one contiguous float32 matrix, memory-mapped for search.
+    - `nodes.db`: A SQLite table with the node, ref doc id and deleted flag of every row of the matrix.
+    - `hnsw.bin`: The HNSW graph index of the matrix, once the corpus is large enough to need one.
+
+    Notes:
+    - Below `exact_search_max` candidate vectors the search is exact: one matrix product per block of
+      `search_batch_size` rows. Above, it goes through the HNSW graph if hnswlib is installed.
+    - Exact-match filters (`==`, `!=`, `in`, `nin`) are supported on the `metadata_fields`, from an inverted index
+      kept in memory. A selective filter, such as a small collection, is searched exactly on its rows only.
+    - Rows are appended, never rewritten: updated and deleted nodes are flagged as deleted.
+    - Vectors are written before their row is committed, under a file lock, so several processes can share
+      the folder. Rows added by the other processes are picked up on the next call.
+    """
+
+    stores_text: bool = True
+    flat_metadata: bool = False
+
+    path: str
+    metadata_fields: List[str]
+    exact_search_max: int = 50000
+    search_batch_size: int = 65536
+    ann_m: int = 16
+    ann_ef_construction: int = 200
+    ann_ef_search: int = 64
+
+    _conn: sqlite3.Connection = PrivateAttr()
+    _lock: threading.RLock = PrivateAttr()
+    _dim: Optional[int] = PrivateAttr(default=None)
+    _version: int = PrivateAttr(default=-1)
+    _n_rows: int = PrivateAttr(default=0)
+    _alive: np.ndarray = PrivateAttr()
+    _vectors: Optional[np.ndarray] = PrivateAttr(default=None)
+    _fields: Dict[str, Dict[str, list]] = PrivateAttr()
+    _field_arrays: Dict[tuple, np.ndarray] = PrivateAttr()
+    _ann: Any = PrivateAttr(default=None)
+    _ann_rows: int = PrivateAttr(default=0)
+    _ann_saved_rows: int = PrivateAttr(default=0)
+
+    def __init__(self, path: str, metadata_fields: List[str], **kwargs: Any) -> None:
+        super().__init__(path=path, metadata_fields=metadata_fields, **kwargs)
+        root = Path(path)
+        root.mkdir(parents=True, exist_ok=True)
+        (root / 'vectors.f32').touch(exist_ok=True)
+        (root / 'nodes.lock').touch(exist_ok=True)
+
+        self._conn = _connect(root / 'nodes.db')
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS nodes (row INTEGER PRIMARY KEY, node_id TEXT NOT NULL, ref_doc_id TEXT, "
+            "data TEXT NOT NULL, deleted INTEGER NOT NULL DEFAULT 0);"
+            "CREATE INDEX IF NOT EXISTS nodes_node_id ON nodes (node_id);"
+            "CREATE INDEX IF NOT EXISTS nodes_ref_doc_id ON nodes (ref_doc_id);"
+            "CREATE INDEX IF NOT EXISTS nodes_deleted ON nodes (row) WHERE deleted = 1;"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);"
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);"
+        )
+        self._lock = threading.RLock()
+        self._alive = np.zeros(0, dtype=bool)
+        self._fields = {field: {} for field in metadata_fields}
+        self._field_arrays = {}
+        self._refresh()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return self._conn
+
+    def __len__(self) -> int:
+        return int(self._alive.sum())
+
+    def _meta(self, key: str) -> Optional[int]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _refresh(self) -> None:
+        with self._lock:
+            version = self._meta('version')
+            if version == self._version:
+                return
+            if self._dim is None:
+                self._dim = self._meta('dim')
+
+            # New rows
+            new_rows = self._conn.execute(
+                "SELECT row, data, deleted FROM nodes WHERE row >= ? ORDER BY row", (self._n_rows,)
+            ).fetchall()
+            if new_rows:
+                n_rows = new_rows[-1][0] + 1
+                alive = np.zeros(n_rows, dtype=bool)
+                alive[:self._n_rows] = self._alive
+                for row, data, deleted in new_rows:
+                    alive[row] = not deleted
+                    metadata = json.loads(data)
+                    for field, index in self._fields.items():
+                        if field in metadata:
+                            index.setdefault(str(metadata[field]), []).append(row)
+                self._alive = alive
+                self._n_rows = n_rows
+
+            # Rows deleted since the last refresh
+            deleted = np.array(
+                [row for (row,) in self._conn.execute("SELECT row FROM nodes WHERE deleted = 1")], dtype=np.int64
+            )
+            # Skip the rows added by another process meanwhile, they are loaded on the next refresh
+            deleted = deleted[deleted < self._n_rows]
+            newly_deleted = deleted[self._alive[deleted]] if len(deleted) else deleted
+            self._alive[newly_deleted] = False
+
+            if self._ann is not None:
+                self._extend_ann(newly_deleted)
+            self._version = version
+
+    def _matrix(self) -> np.ndarray:
+        # Remap the vectors when other rows were added
+        if self._vectors is None or self._vectors.shape[0] < self._n_rows:
+            self._vectors = np.memmap(
+                Path(self.path) / 'vectors.f32', dtype=np.float32, mode='r', shape=(self._n_rows, self._dim)
+            )
+        return self._vectors
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        """
+        Add the nodes with their embeddings, replacing the nodes with the same ids.
+        """
+        if not nodes:
+            return []
+        vectors = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+
+        root = Path(self.path)
+        with self._lock, open(root / 'nodes.lock', 'r+') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                dim = self._meta('dim')
+                if dim is None:
+                    self._conn.execute("INSERT INTO meta (key, value) VALUES ('dim', ?)", (vectors.shape[1],))
+                    dim = vectors.shape[1]
+                elif vectors.shape[1] != dim:
+                    raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the store ({dim}).")
+                self._dim = dim
+
+                first_row = self._conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM nodes").fetchone()[0]
+                with open(root / 'vectors.f32', 'r+b') as vectors_file:
+                    vectors_file.seek(first_row * dim * 4)
+                    vectors_file.write(vectors.tobytes())
+
+                node_ids = [node.node_id for node in nodes]
+                with self._conn:
+                    self._conn.execute("BEGIN")
+                    self._conn.executemany(
+                        "UPDATE nodes SET deleted = 1 WHERE node_id = ? AND deleted = 0", [(i,) for i in node_ids]
+                    )
+                    self._conn.executemany(
+                        "INSERT INTO nodes (row, node_id, ref_doc_id, data) VALUES (?, ?, ?, ?)",
+                        [
+                            (first_row + idx, node.node_id, node.ref_doc_id, json.dumps(
+                                node_to_metadata_dict(node, remove_text=False, flat_metadata=self.flat_metadata)
+                            ))
+                            for idx, node in enumerate(nodes)
+                        ],
+                    )
+                    self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+            self._refresh()
+            self._save_ann()
+        return node_ids
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        """
+        Delete the nodes of a document.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("UPDATE nodes SET deleted = 1 WHERE ref_doc_id = ? AND deleted = 0", (ref_doc_id,))
+            self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        self._refresh()
+
+    def _field_rows(self, field: str, value: Any) -> np.ndarray:
+        rows = self._fields[field].get(str(value), [])
+        cached = self._field_arrays.get((field, str(value)))
+        if cached is None or len(cached) != len(rows):
+            cached = np.asarray(rows, dtype=np.int64)
+            self._field_arrays[(field, str(value))] = cached
+        return cached
+
+    def _filter_mask(self, filters: MetadataFilters) -> np.ndarray:
+        masks = []
+        for metadata_filter in filters.filters:
+            if isinstance(metadata_filter, MetadataFilters):
+                masks.append(self._filter_mask(metadata_filter))
+                continue
+            if metadata_filter.key not in self._fields:
+                raise ValueError(
+                    f"'{metadata_filter.key}' is not an indexed metadata field, use one of {self.metadata_fields}."
+                )
+
+            operator = metadata_filter.operator
+            if operator in (FilterOperator.EQ, FilterOperator.NE):
+                values = [metadata_filter.value]
+            elif operator in (FilterOperator.IN, FilterOperator.NIN):
+                values = list(metadata_filter.value)
+            else:
+                raise ValueError(f"Unsupported filter operator '{operator}', only exact matches are.")
+
+            mask = np.zeros(self._n_rows, dtype=bool)
+            for value in values:
+                mask[self._field_rows(metadata_filter.key, value)] = True
+            masks.append(~mask if operator in (FilterOperator.NE, FilterOperator.NIN) else mask)
+
+        if not masks:
+            return np.ones(self._n_rows, dtype=bool)
+        if filters.condition == FilterCondition.OR:
+            return np.logical_or.reduce(masks)
+        return np.logical_and.reduce(masks)
+
+    def _exact_search(self, query: np.ndarray, mask: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        matrix = self._matrix()
+        candidates = np.flatnonzero(mask)
+        if len(candidates) <= self.search_batch_size:
+            # Only gather the candidate rows
+            sims = matrix[candidates] @ query
+            rows = candidates
+        else:
+            # Keep the best k of every block of rows
+            best_rows, best_sims = [], []
+            for start in range(0, self._n_rows, self.search_batch_size):
+                block_mask = mask[start:start + self.search_batch_size]
+                if not block_mask.any():
+                    continue
+                block_sims = np.asarray(matrix[start:start + len(block_mask)]) @ query
+                block_sims[~block_mask] = -np.inf
+                top = np.argpartition(-block_sims, min(k, len(block_sims) - 1))[:k]
+                best_rows.append(top + start)
+                best_sims.append(block_sims[top])
+            rows, sims = np.concatenate(best_rows), np.concatenate(best_sims)
+            keep = np.isfinite(sims)
+            rows, sims = rows[keep], sims[keep]
+
+        top = np.argsort(-sims, kind='stable')[:k]
+        return rows[top], sims[top]
+
+    def _extend_ann(self, newly_deleted: np.ndarray) -> None:
+        # Add the rows appended since the index was built, and hide the deleted ones
+        if self._n_rows > self._ann_rows:
+            if self._ann.get_max_elements() < self._n_rows:
+                self._ann.resize_index(max(self._n_rows, 2 * self._ann.get_max_elements()))
+            matrix = self._matrix()
+            for start in range(self._ann_rows, self._n_rows, self.search_batch_size):
+                end = min(start + self.search_batch_size, self._n_rows)
+                self._ann.add_items(np.asarray(matrix[start:end]), np.arange(start, end))
+            newly_deleted = np.union1d(
+                newly_deleted, self._ann_rows + np.flatnonzero(~self._alive[self._ann_rows:])
+            )
+            self._ann_rows = self._n_rows
+
+        for row in newly_deleted:
+            try:
+                self._ann.mark_deleted(int(row))
+            except RuntimeError:
+                # Already deleted
+                pass
+
+    def _load_ann(self) -> bool:
+        # The graph holds rows 0 to `rows` - 1, it is only used if it matches its metadata and the matrix
+        root = Path(self.path)
+        if not (root / 'hnsw.json').exists() or not (root / 'hnsw.bin').exists():
+            return False
+        rows = json.loads((root / 'hnsw.json').read_text())['rows']
+        if rows > self._n_rows:
+            return False
+        try:
+            self._ann.load_index(str(root / 'hnsw.bin'), max_elements=self._n_rows)
+        except RuntimeError:
+            return False
+        if self._ann.get_current_count() != rows:
+            return False
+        self._ann_rows = rows
+        return True
+
+    def _build_ann(self) -> None:
+        self._ann = hnswlib.Index(space='ip', dim=self._dim)
+        if not self._load_ann():
+            self._ann = hnswlib.Index(space='ip', dim=self._dim)
+            self._ann.init_index(
+                max_elements=self._n_rows, ef_construction=self.ann_ef_construction, M=self.ann_m
+            )
+            self._ann_rows = 0
+        self._ann_saved_rows = self._ann_rows
+        self._ann.set_ef(self.ann_ef_search)
+        self._extend_ann(np.flatnonzero(~self._alive[:self._ann_rows]))
+        self._save_ann()
+
+    def _save_ann(self) -> None:
+        # Persist the graph when it grew by more than 10% since it was last saved
+        if self._ann is None or self._ann_rows <= self._ann_saved_rows * 1.1:
+            return
+        root = Path(self.path)
+        # Temporary files of their own, so processes saving at the same time never write to the same file
+        tmp_paths = []
+        for suffix in ('.bin.tmp', '.json.tmp'):
+            fd, tmp_path = tempfile.mkstemp(dir=root, prefix='hnsw.', suffix=suffix)
+            os.close(fd)
+            tmp_paths.append(tmp_path)
+        try:
+            self._ann.save_index(tmp_paths[0])
+            Path(tmp_paths[1]).write_text(json.dumps({'rows': self._ann_rows}))
+            # The metadata is replaced last: after a crash in between, the graph no longer matches it and is rebuilt
+            os.replace(tmp_paths[0], root / 'hnsw.bin')
+            os.replace(tmp_paths[1], root / 'hnsw.json')
+        except BaseException:
+            for tmp_path in tmp_paths:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+            raise
+        self._ann_saved_rows = self._ann_rows
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        """
+        Return the `similarity_top_k` nodes most similar (cosine) to the query embedding that match the filters.
+        """
+        self._refresh()
+        k = query.similarity_top_k
+        if not self._n_rows or query.query_embedding is None:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        embedding = np.asarray(query.query_embedding, dtype=np.float32)
+        embedding /= np.linalg.norm(embedding) or 1
+
+        with self._lock:
+            mask = self._alive.copy()
+            if query.filters is not None:
+                mask &= self._filter_mask(query.filters)
+            n_candidates = int(mask.sum())
+
+            use_ann = hnswlib is not None and n_candidates > self.exact_search_max
+            if use_ann and self._ann is None:
+                self._build_ann()
+
+            rows = None
+            if use_ann and n_candidates > k:
+                try:
+                    labels, distances = self._ann.knn_query(
+                        embedding, k=k, num_threads=1,
+                        filter=None if query.filters is None else (lambda label: bool(mask[label])),
+                    )
+                    rows, sims = labels[0].astype(np.int64), 1 - distances[0]
+                except RuntimeError:
+                    # Fewer than k nodes were reached, search exactly
+                    rows = None
+
+        if rows is None:
+            if not n_candidates:
+                return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+            rows, sims = self._exact_search(embedding, mask, k)
+
+        # The connection is shared with the writers of the other threads
+        with self._lock:
+            data = dict(self._conn.execute(
+                f"SELECT row, data FROM nodes WHERE row IN ({','.join('?' * len(rows))})", [int(row) for row in rows]
+            ).fetchall())
+        nodes = [metadata_dict_to_node(json.loads(data[int(row)])) for row in rows]
+        return VectorStoreQueryResult(
+            nodes=nodes,
+            similarities=[float(sim) for sim in sims],
+            ids=[node.node_id for node in nodes],
+        )
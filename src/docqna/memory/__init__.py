@@ -0,0 +1 @@
+from .memory import SummaryBufferMemory, get_chat_memory
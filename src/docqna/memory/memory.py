@@ -0,0 +1,157 @@
+import threading
+import toml
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, List, Optional
+
+from llama_index.core import Settings
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms import LLM, ChatMessage, MessageRole
+from llama_index.core.memory import ChatMemoryBuffer
+
+
+# Get the directory of the current file and construct path to config.toml
+current_dir = Path(__file__).parent
+config_path = current_dir / '..' / '..' / '..' / 'config.toml'
+with open(config_path, 'r') as f:
+    params = toml.load(f)
+
+SUMMARY_PROMPT = (
+    "Progressively summarize the lines of conversation below, adding onto the previous summary. "
+    "Keep the facts, documents, questions and answers needed to follow up on the conversation, "
+    "in at most {max_words} words.\n\n"
+    "Previous summary:\n{summary}\n\n"
+    "New lines of conversation:\n{lines}\n\n"
+    "New summary:"
+)
+
+# Summaries are computed off the critical path of the chats
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-summary")
+
+
+
+class SummaryBufferMemory(ChatMemoryBuffer):
+    """
+    Chat memory that passes the most recent turns to the LLM under a token budget, and a running summary of the
+    turns that fell out of the window.
+
+    Notes:
+    - The full history is kept, `get_all` still returns every message for display.
+    - The summary is updated incrementally in a background thread when messages fall out of the window, and cached
+      in the memory of the session. Until it is ready, the previous summary is used, so a turn never waits for it.
+    - The window never starts with an assistant or tool message, as the LLM needs the message that led to them.
+    - `get_summary` and `set_summary` save and restore the summary, for sessions kept outside of the process.
+    """
+
+    summary_token_limit: int = 300
+
+    _llm: Optional[LLM] = PrivateAttr(default=None)
+    _summary: str = PrivateAttr(default="")
+    _summarized_count: int = PrivateAttr(default=0)
+    _pending: Optional[Future] = PrivateAttr(default=None)
+    _lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, llm: Optional[LLM] = None, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._llm = llm
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SummaryBufferMemory"
+
+    def _summarize(self, summary: str, messages: List[ChatMessage], count: int) -> None:
+        lines = "\n".join(f"{msg.role.value}: {msg.content}" for msg in messages if msg.content)
+        prompt = SUMMARY_PROMPT.format(
+            max_words=int(self.summary_token_limit * 0.75), summary=summary or "(empty)", lines=lines
+        )
+        try:
+            new_summary = (self._llm or Settings.llm).complete(prompt).text.strip()
+        except Exception:
+            # Keep the previous summary, the next turn will try again
+            with self._lock:
+                self._pending = None
+            return
+
+        with self._lock:
+            # Drop the summary if the memory was reset meanwhile
+            if self._summarized_count <= count <= len(self.get_all()):
+                self._summary = new_summary
+                self._summarized_count = count
+            self._pending = None
+
+    def get(self, initial_token_count: int = 0, **kwargs: Any) -> List[ChatMessage]:
+        chat_history = self.get_all()
+
+        with self._lock:
+            summary = self._summary
+        summary_message = ChatMessage(
+            role=MessageRole.SYSTEM, content=f"Summary of the earlier conversation:\n{summary}"
+        ) if summary else None
+        summary_tokens = len(self.tokenizer_fn(summary_message.content)) if summary_message else 0
+
+        window = super().get(initial_token_count=initial_token_count + summary_tokens, **kwargs)
+        while window and window[0].role in (MessageRole.ASSISTANT, MessageRole.TOOL):
+            window = window[1:]
+        older_count = len(chat_history) - len(window)
+
+        # Summarize the messages that fell out of the window since the last summary
+        with self._lock:
+            if self._pending is None and older_count > self._summarized_count:
+                self._pending = _summary_executor.submit(
+                    self._summarize, self._summary, chat_history[self._summarized_count:older_count], older_count
+                )
+
+        return ([summary_message] if summary_message else []) + window
+
+    @property
+    def pending_summary(self) -> Optional[Future]:
+        """
+        The summary being computed in the background, or None.
+        """
+        with self._lock:
+            return self._pending
+
+    def get_summary(self) -> tuple[str, int]:
+        """
+        Return the running summary and the number of messages it covers.
+        """
+        with self._lock:
+            return self._summary, self._summarized_count
+
+    def set_summary(self, summary: str, count: int) -> None:
+        """
+        Restore the running summary of the first `count` messages of the history.
+        """
+        with self._lock:
+            self._summary = summary
+            self._summarized_count = count
+
+    def reset(self) -> None:
+        super().reset()
+        with self._lock:
+            self._summary = ""
+            self._summarized_count = 0
+
+
+
+def get_chat_memory(llm: Optional[LLM] = None) -> ChatMemoryBuffer:
+    """
+    Return a new chat memory for a conversation, following the memory policy in the config.
+
+    Args:
+    - llm (Optional[LLM]): The language model used for the summaries, or None for the default one
+
+    Returns:
+    - ChatMemoryBuffer: A sliding window of the most recent messages under `token_limit`, with a running summary
+      of the older messages if `summarize` is enabled.
+    """
+    config = params['memory']
+    if not config['summarize']:
+        return ChatMemoryBuffer.from_defaults(token_limit=config['token_limit'])
+
+    return SummaryBufferMemory(
+        llm=llm,
+        token_limit=config['token_limit'],
+        summary_token_limit=config['summary_token_limit'],
+    )
@@ -0,0 +1 @@
+from .page_store import PageImageStore, get_page_store, hash_file, PAGE_SIZES
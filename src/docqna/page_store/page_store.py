@@ -0,0 +1,180 @@
+import fcntl
+import hashlib
+import io
+import json
+import os
+import threading
+import toml
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import fitz
+import streamlit as st
+from PIL import Image, features
+
+
+# Get the directory of the current file and construct path to config.toml
+current_dir = Path(__file__).parent
+config_path = current_dir / '..' / '..' / '..' / 'config.toml'
+with open(config_path, 'r') as f:
+    params = toml.load(f)
+
+# Resolution (in DPI) of every size the pages are rendered at
+PAGE_SIZES = {
+    "preview": params['page_images']['preview_dpi'],
+    "full": params['page_images']['full_dpi'],
+}
+
+
+
+def hash_file(path: str) -> str:
+    """
+    Return the SHA-256 hash of the content of a file, the key of its pages in the page image store.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+
+class PageImageStore:
+    """
+    Content-addressed store of the rendered pages of the ingested PDFs.
+
+    Layout:
+    - `blobs/<ab>/<sha256>.<ext>`: The compressed page images, named after the hash of their bytes, so identical
+      pages (blank pages, the same PDF uploaded twice) are only stored once.
+    - `index.jsonl`: An append-only index mapping every (content hash, page, size) to its blob. It is loaded in a
+      dict for O(1) lookups.
+
+    Notes:
+    - Pages are looked up by the content hash of their PDF, kept in the `file_hash` metadata of the nodes, so files
+      with the same name in different collections never show each other's pages.
+    - Pages are rendered at the "preview" and "full" sizes, in WebP if Pillow supports it, in JPEG otherwise.
+    - Appends to the index are locked, so the UI and the service can share the same store.
+    """
+
+    def __init__(self, root: str, image_format: str, quality: int, workers: int) -> None:
+        self.root = Path(root)
+        (self.root / 'blobs').mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / 'index.jsonl'
+        self.index_path.touch(exist_ok=True)
+
+        self.image_format = image_format.upper()
+        if self.image_format == 'WEBP' and not features.check('webp'):
+            self.image_format = 'JPEG'
+        self.mime = f"image/{self.image_format.lower()}"
+        self.quality = quality
+
+        self._index = {}
+        self._index_offset = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="page-render")
+        self._load_index()
+
+    def _load_index(self) -> None:
+        # Only read the entries appended since the last load
+        with self._lock, open(self.index_path, 'r') as f:
+            f.seek(self._index_offset)
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                entry = json.loads(line)
+                self._index[entry['key']] = entry['value']
+                self._index_offset += len(line.encode())
+
+    def _append_index(self, entries: dict) -> None:
+        lines = ''.join(json.dumps({'key': key, 'value': value}) + '\n' for key, value in entries.items())
+        with open(self.index_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(lines)
+            fcntl.flock(f, fcntl.LOCK_UN)
+        with self._lock:
+            self._index.update(entries)
+
+    def _lookup(self, key: str) -> Optional[str]:
+        if key not in self._index:
+            # Another process may have rendered it meanwhile
+            self._load_index()
+        return self._index.get(key)
+
+    def _write_blob(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        blob = f"blobs/{digest[:2]}/{digest}.{self.image_format.lower()}"
+        blob_path = self.root / blob
+        if not blob_path.exists():
+            blob_path.parent.mkdir(exist_ok=True)
+            tmp_path = blob_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, blob_path)
+        return blob
+
+    def _encode(self, pixmap: fitz.Pixmap) -> bytes:
+        image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+        buffer = io.BytesIO()
+        image.save(buffer, format=self.image_format, quality=self.quality)
+        return buffer.getvalue()
+
+    def render(self, pdf_path: str, file_hash: Optional[str] = None) -> int:
+        """
+        Render every page of a PDF at every size, and index them under the hash of its content.
+
+        Args:
+        - pdf_path (str): The path of the PDF file
+        - file_hash (Optional[str]): The hash of the PDF as returned by `hash_file`, computed if not given
+
+        Returns:
+        - int: The number of page images rendered, 0 if the same content was already rendered
+        """
+        doc_hash = file_hash or hash_file(pdf_path)
+
+        entries = {}
+        rendered = 0
+        with fitz.open(pdf_path) as file_handle:
+            for page_idx, page in enumerate(file_handle):
+                for size, dpi in PAGE_SIZES.items():
+                    key = f"page:{doc_hash}:{page_idx + 1}:{size}"
+                    if self._lookup(key) is not None:
+                        continue
+                    entries[key] = self._write_blob(self._encode(page.get_pixmap(dpi=dpi)))
+                    rendered += 1
+
+        if entries:
+            self._append_index(entries)
+        return rendered
+
+    def submit(self, pdf_path: str, file_hash: Optional[str] = None) -> Future:
+        """
+        Render a PDF in the background, see `render`.
+        """
+        return self._executor.submit(self.render, pdf_path, file_hash)
+
+    def get_page(self, file_hash: str, page_num: int, size: str = "preview") -> Optional[bytes]:
+        """
+        Return the image bytes of a page of the PDF with the given content hash, or None if it was not rendered.
+        """
+        blob = self._lookup(f"page:{file_hash}:{page_num}:{size}")
+        if blob is None:
+            return None
+        return (self.root / blob).read_bytes()
+
+
+
+@st.cache_resource
+def get_page_store() -> Optional[PageImageStore]:
+    """
+    Initialize and return the page image store shared by all the sessions, or None if it is disabled in the config.
+    """
+    config = params['page_images']
+    if not config['enabled']:
+        return None
+
+    return PageImageStore(
+        root=config['store_path'],
+        image_format=config['format'],
+        quality=config['quality'],
+        workers=config['workers'],
+    )
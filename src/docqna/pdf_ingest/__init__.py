@@ -1 +1 @@
-from .pdf_ingest import get_pdf_text_ocr, get_pdf_text, get_text_nodes
+from .pdf_ingest import get_pdf_text_ocr, get_pdf_text, get_page_num, PAGE_NUM_PATTERN, save_document, extract_saved_document, CustomUploadedFile, format_dedupe_stats
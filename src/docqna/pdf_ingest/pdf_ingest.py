@@ -1,23 +1,197 @@
-from typing import Any,List
+from typing import Any, Callable, List, Optional
 from PyPDF2 import PdfReader
+from fpdf import FPDF
 
 from pdf2image import convert_from_path
 import pytesseract
 from PIL import Image
+import copy
+import io
 import os
+import re
+import subprocess
 import tempfile
+import toml
+from pathlib import Path
 import streamlit as st
 
 
 # Llama Index
 from llama_index.core import Document
-from llama_index.core.schema import TextNode
-from llama_index.core.ingestion import (
-    IngestionPipeline
-)
 
-# For tracking error
-from torch.cuda import OutOfMemoryError
+from ..page_store import get_page_store, hash_file
+
+
+# Get the directory of the current file and construct path to config.toml
+current_dir = Path(__file__).parent
+config_path = current_dir / '..' / '..' / '..' / 'config.toml'
+with open(config_path, 'r') as f:
+    params = toml.load(f)
+# The directory where the uploaded files are saved
+dir_path = params['paths']['data_path']
+os.makedirs(dir_path, exist_ok=True)
+
+# Regular expression pattern to find the page number references added during extraction
+PAGE_NUM_PATTERN = r'PAGE_NUM=(\d+)'
+
+
+
+class CustomUploadedFile(io.BytesIO):
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+    def __repr__(self):
+        return f"CustomUploadedFile(name={self.name}, size={len(self.getvalue())})"
+    
+
+
+def convert_docx_to_pdf(input_file, output_file):
+    subprocess.run(["pandoc", "-o", output_file, input_file])
+
+
+
+# Function to save the uploaded file
+def save_uploaded_file(uploaded_file, notify: Callable[[str], Any] = st.error):
+    try:
+        # Create the directory if it doesn't exist
+        os.makedirs(dir_path, exist_ok=True)
+        
+        # Save the file to the specified directory
+        file_path = os.path.join(dir_path, uploaded_file.name)
+        with open(file_path, 'wb') as f:
+            f.write(uploaded_file.getbuffer())
+    except Exception as e:
+        notify(f'Error saving file: {e}')
+
+
+
+
+
+def txt_to_pdf(txt_file_path, pdf_file_path):
+    # Create a new PDF object
+    pdf = FPDF()
+    # Open the text file for reading
+    with open(txt_file_path, 'r', encoding='latin-1') as txt_file:
+        # Get the content of the text file
+        txt_content = txt_file.read()
+    # Split the text content into lines
+    lines = txt_content.splitlines()
+    # Add a new page to the PDF
+    pdf.add_page()
+    # Set the font and font size
+    pdf.set_font('Arial', size=12)
+    # Loop through the lines and add them to the PDF
+    for line in lines:
+        pdf.cell(w=200, h=10, txt=line, ln=1, align='L') # type: ignore
+    # Save the PDF
+    pdf.output(pdf_file_path)
+
+
+
+def save_document(file: Any, notify: Callable[[str], Any] = st.warning) -> Optional[str]:
+    """
+    Save an uploaded file under the data path, and convert it to PDF if it is a DOCX or TXT file.
+
+    Args:
+    - file (Any): An uploaded PDF, DOCX or TXT file object, with a `name` attribute.
+    - notify (Callable[[str], Any]): Called with the warnings for the user, `st.warning` by default.
+
+    Returns:
+    - Optional[str]: The path of the PDF, or None if the file could not be converted.
+    """
+    pdf_path = os.path.join(dir_path, os.path.splitext(file.name)[0] + ".pdf")
+
+    if file.name.endswith(".pdf") :
+        save_uploaded_file(file, notify)
+
+    elif file.name.endswith(".docx"):
+        docx_path = os.path.join(dir_path, file.name)
+        
+        # Save the docx file
+        with open(docx_path, "wb") as f:
+            f.write(file.read())
+        # Convert the docx file to pdf
+        convert_docx_to_pdf(docx_path, pdf_path)
+
+    elif file.name.endswith(".txt"):
+        txt_path = os.path.join(dir_path, file.name)
+        # Save the txt file
+        with open(txt_path, "wb") as f:
+            f.write(file.read())
+        # Convert the txt file to pdf
+        txt_to_pdf(txt_path, pdf_path)
+
+    # The PDF is extracted from the upload itself, the converted files from the saved PDF
+    if not file.name.endswith(".pdf") and not os.path.exists(pdf_path):
+        notify(f"PDF file {os.path.basename(pdf_path)} not found.")
+        return None
+    return pdf_path
+
+
+
+def extract_saved_document(file: Any, pdf_path: Optional[str],
+                           notify: Callable[[str], Any] = st.warning) -> list[Document]:
+    """
+    Extract the text content of an uploaded file saved by `save_document` to Llama Index Documents.
+
+    Args:
+    - file (Any): The uploaded file object, with a `name` attribute.
+    - pdf_path (Optional[str]): The path of the saved PDF, as returned by `save_document`.
+    - notify (Callable[[str], Any]): Called with the warnings for the user, `st.warning` by default.
+
+    Returns:
+    - list[Document]: A list of LLama Index Documents of the file, empty if the file could not be converted.
+
+    Notes:
+    - Passes PDFs for performing OCR on them if they dont contain any text.
+    - If the page image store is enabled, the pages of the PDF are rendered in the background for the page previews,
+      and the documents carry the content hash of the PDF in their `file_hash` metadata to look the pages up.
+    """
+    if pdf_path is None:
+        return []
+
+    if file.name.endswith(".pdf") :
+        # Keep a copy for OCR, extracting the text consumes the file
+        copy_file = copy.deepcopy(file)
+        document_list = get_pdf_text(file)
+        # Check if document contains an error
+        # Fallback to OCR if extracting text from PDF fails
+        if document_list[0].text == 'Error':
+            notify("Error extracting text from PDFs using the first method. Trying OCR...")
+            document_list = get_pdf_text_ocr(copy_file)
+    else:
+        # Read the converted PDF file
+        with open(pdf_path, "rb") as f:
+            pdf_bytes = f.read()
+        uploaded_file = CustomUploadedFile(pdf_bytes, os.path.basename(pdf_path))
+        document_list = get_pdf_text(uploaded_file)
+
+    # Pre-render the pages while the documents are split and embedded
+    page_store = get_page_store()
+    if page_store is not None and document_list and os.path.exists(pdf_path):
+        file_hash = hash_file(pdf_path)
+        for document in document_list:
+            document.metadata['file_hash'] = file_hash
+            # Only used to look the pages up, keep it out of the embedding and LLM text
+            for excluded_keys in (document.excluded_embed_metadata_keys, document.excluded_llm_metadata_keys):
+                if 'file_hash' not in excluded_keys:
+                    excluded_keys.append('file_hash')
+        page_store.submit(pdf_path, file_hash)
+
+    return document_list
+
+
+
+def format_dedupe_stats(stats: dict) -> str:
+    """
+    Return a message with the boilerplate and near-duplicate text skipped by an ingestion.
+    """
+    return (
+        f"Boilerplate: {stats['boilerplate_lines']:,} lines stripped, "
+        f"near-duplicates: {stats['duplicate_nodes']:,} chunks skipped "
+        f"({stats['boilerplate_chars'] + stats['duplicate_chars']:,} characters not embedded)"
+    )
 
 
 
@@ -118,46 +292,15 @@ def get_pdf_text_ocr(pdf_file: Any) -> List[Document]:
 
 
 
-def get_text_nodes(documents: list[Document],
-                   pipeline: IngestionPipeline) -> list[TextNode]:
-    """
-    Run the full pipeline on the documents to generate TextNodes.
-    If there is an error while running the pipeline, prevent the pipeline from tracking the document.
+def get_page_num(text: str):
+    # Find all matches of the pattern in the text
+    matches = re.findall(PAGE_NUM_PATTERN, text)
 
-    Args:
-    - documents (list[Document]): A list of Llama Index Documents to be split into nodes.
-    - embed_model (HuggingFaceEmbedding): An embedding model from Hugging Face to generate embeddings of the data 
-    - pipeline (IngestionPipeline): A Llama Index IngestionPipeline class that contains the information for document tracking
-                                    vectore storage, and Sentence splitting parameters.
+    # Use a set to store unique page numbers
+    unique_page_numbers = set()
 
-    Returns:
-    - list[TextNode]: A list of TextNodes(Llama Index) where each node is a chunk of the extracted text that will be passed as context
-                      or returns None if there was an error 
+    # Extract the numbers from the matches and store them in a set to ensure uniqueness
+    for match in matches:
+        unique_page_numbers.add(int(match))
 
-                      
-    """
-    
-
-    # Run the pipeline on the documents and prevent the pipeline from 
-    # tracking the documents that were not succesfully ingested if an error occured
-    try:
-        nodes = pipeline.run(documents=documents)
-        st.info(
-            f"Number of Nodes Ingested: {len(nodes):,}"
-        )
-
-    except (Exception, OutOfMemoryError) as e:
-        # Delete all the unprocessed document ids from the docstore
-        for document in documents:
-            pipeline.docstore.delete_document(document.id_, raise_error=False)
-
-        # Set nodes to None as an Error flag
-        nodes = None
-        st.error(
-            f"A {type(e).__name__} occurred  \n" 
-            "Deleting the docs from pipeline to retry"
-        )
-
-
-    # Return list of TextNodes(Llama Index) or None if there was an error 
-    return nodes
+    return list(unique_page_numbers)
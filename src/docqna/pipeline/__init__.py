@@ -1 +1 @@
-from .pipeline import get_pipeline
+from .pipeline import get_pipeline, get_embed_model, get_vector_store, get_kvstore, get_redis_url, embed_queries, METADATA_FIELDS
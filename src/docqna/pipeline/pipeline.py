@@ -4,6 +4,7 @@ from pathlib import Path
 import streamlit as st
 
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.embeddings.huggingface.utils import format_query
 from llama_index.core.ingestion import (
     DocstoreStrategy,
     IngestionPipeline,
@@ -11,10 +12,17 @@ from llama_index.core.ingestion import (
 )
 from llama_index.storage.kvstore.redis import RedisKVStore as RedisCache
 from llama_index.storage.docstore.redis import RedisDocumentStore
+from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.core.storage.kvstore.types import BaseKVStore
+from llama_index.core.vector_stores.types import BasePydanticVectorStore
 from llama_index.core.node_parser import SentenceSplitter, SemanticSplitterNodeParser
 from llama_index.vector_stores.redis import RedisVectorStore
 from llama_index.core.schema import TransformComponent
 
+from ..embed_cache import get_cached_embed_model
+from ..local_store import LocalVectorStore, SQLiteKVStore
+from ..dedupe import BoilerplateStripper, NearDuplicateFilter
+
 
 # Load parameters from the TOML file
 # with open('../config.toml', 'r') as f:
@@ -24,59 +32,184 @@ config_path = current_dir / '..' / '..' / '..' / 'config.toml'
 with open(config_path, 'r') as f:
     params = toml.load(f)
 
+# Metadata fields indexed by the vector stores, so the retrieval can be filtered on them
+METADATA_FIELDS = ["source", "page_num", "collection"]
+
+
+def get_redis_url() -> str:
+    """
+    Return the URL of the Redis Server from the config.
+    """
+    return "redis://" + params['redis']['host_name'] + ":" + str(params['redis']['port_no'])
+
+
+
+@st.cache_resource
+def get_embed_model() -> HuggingFaceEmbedding:
+    """
+    Initialize and return the embedding model shared by every collection and session.
+
+    Notes:
+    - The SentenceTransformerEmbeddings model used is "BAAI/bge-base-en-v1.5", and its cached data is stored in "./store/models".
+    """
+
+    # Define the embedding model from the HuggingFace Library
+    return HuggingFaceEmbedding(
+        model_name=params['embed_model']['model_name'], 
+        cache_folder= params['embed_model']['cache_folder'], 
+        embed_batch_size= params['embed_model']['embed_batch_size']
+    )
+
+
+
+def embed_queries(embed_model: HuggingFaceEmbedding, queries: list[str]) -> list[list[float]]:
+    """
+    Embed a batch of queries with a single forward pass of the embedding model.
+
+    Args:
+    - embed_model (HuggingFaceEmbedding): The embedding model to use
+    - queries (list[str]): The queries to embed
+
+    Returns:
+    - list[list[float]]: The embedding of every query, in the same order
+
+    Notes:
+    - The query instruction of the model is added to every query, as `get_query_embedding` does.
+    - `embed_batch_size` is bypassed on purpose: it is kept low for ingesting large chunks, while queries are short.
+    """
+    formatted = [format_query(query, embed_model.model_name, embed_model.query_instruction) for query in queries]
+    return embed_model._get_text_embeddings(formatted)
+
+
 
 @st.cache_resource
-def get_pipeline() -> dict:
+def get_vector_store() -> BasePydanticVectorStore:
+    """
+    Initialize and return the vector store shared by every collection, from the storage backend in the config.
+
+    Notes:
+    - "redis": A RedisVectorStore on the Redis Server.
+    - "local": A LocalVectorStore in `local_path`, searched in-process, for single-node deployments without Redis.
+    - The `collection` metadata field is indexed as a tag, so queries can be pre-filtered to a single collection
+      and only search the vectors of that collection.
+    """
+    if params['storage']['backend'] == 'local':
+        config = params['storage']
+        return LocalVectorStore(
+            path=os.path.join(config['local_path'], params['redis']['vector_index_name']),
+            metadata_fields=METADATA_FIELDS,
+            exact_search_max=config['exact_search_max'],
+            search_batch_size=config['search_batch_size'],
+            ann_m=config['ann_m'],
+            ann_ef_construction=config['ann_ef_construction'],
+            ann_ef_search=config['ann_ef_search'],
+        )
+
+    return RedisVectorStore(
+        index_name=params['redis']['vector_index_name'],
+        index_prefix=params['redis']['vector_index_prefix'],
+        redis_url=get_redis_url(),
+        metadata_fields=METADATA_FIELDS,
+        # index_args = {'dims:': 3072}
+    )
+
+
+
+@st.cache_resource
+def get_kvstore() -> BaseKVStore:
+    """
+    Initialize and return the KV store used by the docstores, the ingestion cache and the collection registry.
+
+    Notes:
+    - "redis": A RedisKVStore on the Redis Server.
+    - "local": A SQLiteKVStore in `local_path`.
     """
-    Initialize and return the embedding model and LLama-Index IngestionPipeline 
+    if params['storage']['backend'] == 'local':
+        os.makedirs(params['storage']['local_path'], exist_ok=True)
+        return SQLiteKVStore(os.path.join(params['storage']['local_path'], 'kv.db'))
+
+    return RedisCache.from_host_and_port(params['redis']['host_name'], params['redis']['port_no'])
+
+
+
+@st.cache_resource
+def get_pipeline(collection: str = params['collections']['default']) -> dict:
+    """
+    Initialize and return the embedding model and LLama-Index IngestionPipeline of a collection
+
+    Args:
+    - collection (str): The name of the collection the documents are ingested in
 
     Returns:
     - Dict: A dictionory of the embedding model and LLama-Index IngestionPipeline 
 
     Notes:
-    - The SentenceTransformerEmbeddings model used is "BAAI/bge-base-en-v1.5", and its cached data is stored in "./store/models".
+    - The embedding model, the vector store and the cache are shared by all the collections.
+    - If dedupe is enabled, the boilerplate lines repeated across the pages of a document are stripped before
+      splitting, and the chunks that are near-duplicates of chunks of the collection are dropped before embedding.
+      The embedding model is always the last transformation.
+    - The splitter and the embedding step read the text embeddings from the persistent embedding cache, which is
+      keyed by model and text rather than by node and transformations, so re-chunking reuses the embeddings.
       
       The Ingestion pipeline contains the following features:
     - Splitting: The function uses the SentenceSplitter with a chunk size of 1,000 characters and an overlap of 100 characters.
-    - DocumentStore: For passing the location for storing the documents. Uses RedisDocumentStore for storage and doc tracking
-    - VectorStore: For passing the location for storing the vectors. Uses RedisVectorStore for storage 
+    - DocumentStore: For passing the location for storing the documents. Uses RedisDocumentStore (or a KVDocumentStore on the
+                     local KV store) for storage and doc tracking, with one namespace per collection.
+    - VectorStore: For passing the location for storing the vectors. Uses the vector store of the storage backend 
     - IngestionCache: All node + transformation combinations will have their outputs cached, which will save time on duplicate runs.
     - Docstore Strategy: The strategy to track and update documents. Uses DUPLICATES_ONLY strategy that checks for existence 
                          of any duplicate file and prevents it from being ingested again.
     """
 
-    # Define the embedding model from the HuggingFace Library
-    embed_model = HuggingFaceEmbedding(
-        model_name=params['embed_model']['model_name'], 
-        cache_folder= params['embed_model']['cache_folder'], 
-        embed_batch_size= params['embed_model']['embed_batch_size']
-    )
+    embed_model = get_embed_model()
+    ingest_embed_model = get_cached_embed_model(embed_model)
+
+    docstore_namespace = f"{params['redis']['doc_store_name']}_{collection}"
+    if params['storage']['backend'] == 'local':
+        docstore = KVDocumentStore(get_kvstore(), namespace=docstore_namespace)
+    else:
+        docstore = RedisDocumentStore.from_host_and_port(
+            params['redis']['host_name'], params['redis']['port_no'], namespace=docstore_namespace
+        )
+
+    # Boilerplate is stripped from the Documents before splitting, near-duplicate nodes are dropped before embedding
+    dedupe = params['dedupe']
+    pre_split, pre_embed = [], []
+    if dedupe['enabled']:
+        pre_split.append(BoilerplateStripper(
+            min_pages=dedupe['boilerplate_min_pages'],
+            min_page_ratio=dedupe['boilerplate_min_page_ratio'],
+            min_letters=dedupe['boilerplate_min_letters'],
+        ))
+        pre_embed.append(NearDuplicateFilter(
+            get_kvstore(),
+            collection=collection,
+            index_name=dedupe['index_name'],
+            shingle_size=dedupe['shingle_size'],
+            num_perm=dedupe['num_perm'],
+            bands=dedupe['bands'],
+            threshold=dedupe['threshold'],
+        ))
 
     # Initialising the Ingestion Pipeline for Document Ingestion
     pipeline = IngestionPipeline(
         transformations=[
+            *pre_split,
             # SentenceSplitter(chunk_size=params['transformations']['chunk_size'],
             #                   chunk_overlap=params['transformations']['chunk_overlap']
             #                 ),
-            SemanticSplitterNodeParser(buffer_size=1, breakpoint_percentile_threshold=95, embed_model=embed_model), # type: ignore
-            embed_model,
+            SemanticSplitterNodeParser(buffer_size=1, breakpoint_percentile_threshold=95, embed_model=ingest_embed_model), # type: ignore
+            *pre_embed,
+            ingest_embed_model,
 
         ],
 
-        docstore=RedisDocumentStore.from_host_and_port(
-            params['redis']['host_name'], params['redis']['port_no'], namespace=params['redis']['doc_store_name']
-        ), 
+        docstore=docstore,
 
-        vector_store=RedisVectorStore(
-            index_name=params['redis']['vector_index_name'],
-            index_prefix=params['redis']['vector_index_prefix'],
-            redis_url="redis://" + params['redis']['host_name'] + ":" + str(params['redis']['port_no']),
-            metadata_fields=["source", "page_num"],
-            # index_args = {'dims:': 3072}
-        ),
+        vector_store=get_vector_store(),
 
         cache=IngestionCache(
-            cache=RedisCache.from_host_and_port(params['redis']['host_name'], params['redis']['port_no']),
+            cache=get_kvstore(),
             collection=params['redis']['cache_name'],
         ),
 
@@ -0,0 +1 @@
+from .postprocess import CrossEncoderRerank, ContextCompressor, get_postprocessors
@@ -0,0 +1,245 @@
+import hashlib
+import itertools
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, List, Optional
+
+import numpy as np
+import toml
+import streamlit as st
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.node_parser.text.utils import split_by_sentence_tokenizer
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.utils import get_tokenizer
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+from ..pdf_ingest import PAGE_NUM_PATTERN
+
+
+# Get the directory of the current file and construct path to config.toml
+current_dir = Path(__file__).parent
+config_path = current_dir / '..' / '..' / '..' / 'config.toml'
+with open(config_path, 'r') as f:
+    params = toml.load(f)
+
+
+
+class CrossEncoderRerank(BaseNodePostprocessor):
+    """
+    Rerank the retrieved nodes with a local cross-encoder and keep the `top_n` best ones.
+
+    Notes:
+    - The (query, node) pairs are scored in batches of `batch_size` on the CPU.
+    - Scores are kept in an LRU cache keyed by the query and the node content hash, so repeated
+      or follow-up questions over the same chunks don't pay for the model again.
+    """
+
+    model: str = Field(description="Name of the cross-encoder model to load.")
+    top_n: int = Field(description="Number of nodes to return after reranking.")
+    batch_size: int = Field(default=16, description="Number of pairs scored at once.")
+    cache_size: int = Field(default=4096, description="Number of scores kept in the cache.")
+
+    _model: Any = PrivateAttr()
+    _cache: OrderedDict = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        from sentence_transformers import CrossEncoder
+
+        self._model = CrossEncoder(self.model, max_length=512, device="cpu")
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CrossEncoderRerank"
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore],
+                           query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        if query_bundle is None:
+            raise ValueError("Missing query bundle in extra info.")
+        if len(nodes) == 0:
+            return []
+
+        query_hash = hashlib.sha256(query_bundle.query_str.encode()).hexdigest()
+        keys = [(query_hash, node.node.hash) for node in nodes]
+
+        # Only score the pairs that are not in the cache
+        with self._lock:
+            scores = {key: self._cache[key] for key in keys if key in self._cache}
+            for key in scores:
+                self._cache.move_to_end(key)
+        missing = [idx for idx, key in enumerate(keys) if key not in scores]
+
+        if missing:
+            pairs = [(query_bundle.query_str, nodes[idx].node.get_content()) for idx in missing]
+            new_scores = self._model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+            with self._lock:
+                for idx, score in zip(missing, new_scores):
+                    scores[keys[idx]] = float(score)
+                    self._cache[keys[idx]] = float(score)
+                # Evict the least recently used scores
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        for node, key in zip(nodes, keys):
+            node.score = scores[key]
+
+        return sorted(nodes, key=lambda node: node.score, reverse=True)[:self.top_n]
+
+
+
+class ContextCompressor(BaseNodePostprocessor):
+    """
+    Compress every node to the sentences that are relevant to the query, under a token budget
+    shared by all the nodes.
+
+    Notes:
+    - Sentences are scored by the cosine similarity of their embedding with the query embedding. They are embedded
+      `batch_size` at a time rather than with the `embed_batch_size` of the model, which is kept low for ingestion.
+    - The best sentence of each node is always considered first, so that reranked sources survive.
+    - Kept sentences are put back in their original order, wrapped in their PAGE_NUM markers so the
+      page tracking keeps working on the compressed text.
+    """
+
+    token_budget: int = Field(description="Maximum number of tokens across all the compressed nodes.")
+    min_similarity: float = Field(default=0.4, description="Sentences below this similarity are dropped.")
+    batch_size: int = Field(default=64, description="Number of sentences embedded at once.")
+
+    _embed_model: HuggingFaceEmbedding = PrivateAttr()
+    _split: Any = PrivateAttr()
+    _tokenizer: Any = PrivateAttr()
+
+    def __init__(self, embed_model: HuggingFaceEmbedding, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._embed_model = embed_model
+        self._split = split_by_sentence_tokenizer()
+        self._tokenizer = get_tokenizer()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextCompressor"
+
+    def _split_sentences(self, text: str) -> list[tuple[Optional[int], str]]:
+        # Splitting on the pattern gives [text, page, text, page, text, ...]
+        parts = re.split(PAGE_NUM_PATTERN, text)
+        sentences = []
+        for idx, segment in enumerate(parts[0::2]):
+            # A chunk can start in the middle of a page: the text before its first marker is on the page it closes
+            if idx > 0:
+                page = int(parts[2 * idx - 1])
+            else:
+                page = int(parts[1]) if len(parts) > 1 else None
+            for sentence in self._split(segment):
+                if sentence.strip():
+                    sentences.append((page, sentence.strip()))
+        return sentences
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore],
+                           query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        if query_bundle is None:
+            raise ValueError("Missing query bundle in extra info.")
+        if len(nodes) == 0:
+            return []
+
+        node_sentences = [self._split_sentences(node.node.get_content()) for node in nodes]
+        flat = [(node_idx, sent_idx, sentence)
+                for node_idx, sentences in enumerate(node_sentences)
+                for sent_idx, (_, sentence) in enumerate(sentences)]
+        if not flat:
+            return nodes
+
+        # Score every sentence against the query, `batch_size` sentences per forward pass
+        query_embedding = query_bundle.embedding or self._embed_model.get_query_embedding(query_bundle.query_str)
+        query_vec = np.asarray(query_embedding, dtype=np.float32)
+        texts = [sentence for _, _, sentence in flat]
+        sent_vecs = np.asarray([
+            embedding
+            for start in range(0, len(texts), self.batch_size)
+            for embedding in self._embed_model._get_text_embeddings(texts[start:start + self.batch_size])
+        ], dtype=np.float32)
+        sims = sent_vecs @ query_vec / (np.linalg.norm(sent_vecs, axis=1) * np.linalg.norm(query_vec) + 1e-10)
+
+        # Best sentence of each node first (in rank order), then everything else by similarity
+        best = {}
+        for flat_idx, (node_idx, _, _) in enumerate(flat):
+            if node_idx not in best or sims[flat_idx] > sims[best[node_idx]]:
+                best[node_idx] = flat_idx
+        order = [best[node_idx] for node_idx in sorted(best)]
+        firsts = set(order)
+        order += [idx for idx in np.argsort(-sims) if idx not in firsts and sims[idx] >= self.min_similarity]
+
+        selected, used = set(), 0
+        for flat_idx in order:
+            node_idx, sent_idx, sentence = flat[flat_idx]
+            n_tokens = len(self._tokenizer(sentence))
+            # Always keep something from the top node, even if its best sentence is over budget
+            if used + n_tokens > self.token_budget and selected:
+                continue
+            selected.add((node_idx, sent_idx))
+            used += n_tokens
+
+        compressed_nodes = []
+        for node_idx, node in enumerate(nodes):
+            kept = [sentence for sent_idx, sentence in enumerate(node_sentences[node_idx])
+                    if (node_idx, sent_idx) in selected]
+            if not kept:
+                continue
+
+            # Put back the page markers around each run of sentences from the same page
+            pieces = []
+            for page, group in itertools.groupby(kept, key=lambda sentence: sentence[0]):
+                body = ' '.join(sentence for _, sentence in group)
+                pieces.append(f'\n PAGE_NUM={page} \n {body} \n PAGE_NUM={page} \n' if page is not None else body)
+
+            new_node = node.node.copy()
+            new_node.text = ''.join(pieces)
+            compressed_nodes.append(NodeWithScore(node=new_node, score=node.score))
+
+        return compressed_nodes
+
+
+
+@st.cache_resource
+def get_postprocessors(_embed_model: HuggingFaceEmbedding) -> list[BaseNodePostprocessor]:
+    """
+    Initialize and return the post-retrieval stages applied to the retrieved nodes before they are passed to the LLM.
+
+    Args:
+    - _embed_model (HuggingFaceEmbedding): The embedding model used to score the sentences during compression
+
+    Returns:
+    - list[BaseNodePostprocessor]: The reranking and compression stages, empty if the post-processing is disabled
+
+    Notes:
+    - The stages are cached as a resource so the cross-encoder and its score cache are shared by all the sessions.
+    - The number of nodes over-retrieved for the stages is set by `similarity_top_k` in the config.
+    """
+    config = params['postprocess']
+    if not config['enabled']:
+        return []
+
+    postprocessors = [
+        CrossEncoderRerank(
+            model=config['rerank_model'],
+            top_n=config['rerank_top_n'],
+            batch_size=config['rerank_batch_size'],
+            cache_size=config['score_cache_size'],
+        )
+    ]
+    if config['compress']:
+        postprocessors.append(
+            ContextCompressor(
+                _embed_model,
+                token_budget=config['token_budget'],
+                min_similarity=config['min_similarity'],
+                batch_size=config['compress_batch_size'],
+            )
+        )
+
+    return postprocessors
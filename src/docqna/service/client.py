@@ -0,0 +1,67 @@
+import uuid
+from typing import Any, List, Optional
+
+import httpx
+
+from llama_index.core.chat_engine.types import AgentChatResponse
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.schema import NodeWithScore, TextNode
+
+
+
+def _dict_to_node(node: dict) -> NodeWithScore:
+    return NodeWithScore(
+        node=TextNode(id_=node['id'], text=node['text'], metadata=node['metadata']),
+        score=node['score'],
+    )
+
+
+
+class ServiceClient:
+    """
+    Thin client of the query/ingest service for one session and collection.
+
+    Notes:
+    - `chat` and `chat_history` mirror the Llama Index chat engine, so the UI handles both the same way.
+    - The answers and source nodes are rebuilt as Llama Index objects from the service responses.
+    """
+
+    def __init__(self, url: str, collection: str, session_id: Optional[str] = None, timeout: float = 600,
+                 mode: str = "single") -> None:
+        self.collection = collection
+        self.mode = mode
+        self.session_id = session_id or uuid.uuid4().hex
+        self.chat_history: List[ChatMessage] = []
+        self._client = httpx.Client(base_url=url, timeout=timeout)
+
+    def chat(self, query: str, tool_choice: Optional[str] = None) -> AgentChatResponse:
+        # The service always retrieves from the index, so the tool choice is not sent
+        response = self._client.post(
+            "/chat",
+            json={"session_id": self.session_id, "query": query, "collection": self.collection, "mode": self.mode},
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        self.chat_history = [
+            ChatMessage(role=MessageRole(msg['role']), content=msg['content']) for msg in data['chat_history']
+        ]
+        return AgentChatResponse(
+            response=data['response'], source_nodes=[_dict_to_node(node) for node in data['source_nodes']]
+        )
+
+    def retrieve(self, query: str, top_k: Optional[int] = None) -> List[NodeWithScore]:
+        response = self._client.post(
+            "/retrieve", json={"query": query, "collection": self.collection, "top_k": top_k}
+        )
+        response.raise_for_status()
+        return [_dict_to_node(node) for node in response.json()['nodes']]
+
+    def ingest(self, files: List[Any]) -> dict:
+        response = self._client.post(
+            "/ingest",
+            files=[("files", (file.name, file.getvalue())) for file in files],
+            data={"collection": self.collection},
+        )
+        response.raise_for_status()
+        return response.json()
@@ -0,0 +1,450 @@
+import asyncio
+import toml
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterator, List, Literal, Optional, Sequence
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from pydantic import BaseModel
+from redis.asyncio import Redis
+
+from llama_index.core import VectorStoreIndex
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.memory.types import BaseMemory
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.llms.openai import OpenAI
+
+from ..chat import get_conversation_engine, get_retrieval_kwargs
+from ..collection import create_collection, update_collection_stats, validate_collection_name
+from ..ingest import ingest_files
+from ..memory import SummaryBufferMemory, get_chat_memory
+from ..pdf_ingest import CustomUploadedFile
+from ..pipeline import embed_queries, get_embed_model, get_kvstore, get_redis_url, get_vector_store
+from ..subquestion import get_subquestion_engine
+
+
+# Get the directory of the current file and construct path to config.toml
+current_dir = Path(__file__).parent
+config_path = current_dir / '..' / '..' / '..' / 'config.toml'
+with open(config_path, 'r') as f:
+    params = toml.load(f)
+
+# Load environment variables
+load_dotenv(dotenv_path="../.env")
+load_dotenv(dotenv_path="./.env")
+
+
+
+class QueryEmbeddingBatcher:
+    """
+    Collect the queries of concurrent requests and embed them together.
+
+    Notes:
+    - A batch is embedded as soon as it holds `max_batch_size` queries, or `max_wait_ms` after its first query.
+    - The embedding runs in a thread of its own, so the event loop keeps serving requests meanwhile, and the
+      batches don't wait behind the retrievals and chats that fill the default executor.
+    """
+
+    def __init__(self, embed_model: HuggingFaceEmbedding, max_batch_size: int, max_wait_ms: float) -> None:
+        self.embed_model = embed_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-embed")
+
+    async def embed(self, query: str) -> List[float]:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, future))
+        return await future
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                embeddings = await loop.run_in_executor(
+                    self._executor, embed_queries, self.embed_model, [query for query, _ in batch]
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+
+class LLMSlots:
+    """
+    Limit the number of LLM calls running at once, from the event loop and from worker threads.
+
+    Notes:
+    - The slots are held for a single LLM call, not for a whole chat, so retrieval and post-processing never wait for them.
+    - Worker threads wait for a slot on the event loop. A sync call made on the event loop itself is not limited,
+      as waiting there would block the loop.
+    """
+
+    def __init__(self, limit: int, loop: asyncio.AbstractEventLoop) -> None:
+        self.semaphore = asyncio.Semaphore(limit)
+        self._loop = loop
+
+    @contextmanager
+    def acquire(self) -> Iterator[None]:
+        try:
+            in_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            yield
+            return
+
+        asyncio.run_coroutine_threadsafe(self.semaphore.acquire(), self._loop).result()
+        try:
+            yield
+        finally:
+            self._loop.call_soon_threadsafe(self.semaphore.release)
+
+
+
+class SlottedOpenAI(OpenAI):
+    """
+    OpenAI LLM that holds one of the `LLMSlots` of the service during every chat and completion call.
+    """
+
+    _slots: LLMSlots = PrivateAttr()
+
+    def __init__(self, slots: LLMSlots, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._slots = slots
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SlottedOpenAI"
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> Any:
+        with self._slots.acquire():
+            return super().chat(messages, **kwargs)
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> Any:
+        with self._slots.acquire():
+            return super().complete(prompt, formatted=formatted, **kwargs)
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> Any:
+        async with self._slots.semaphore:
+            return await super().achat(messages, **kwargs)
+
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> Any:
+        async with self._slots.semaphore:
+            return await super().acomplete(prompt, formatted=formatted, **kwargs)
+
+
+
+class BatchedQueryEmbedding(BaseEmbedding):
+    """
+    Embedding model that sends the query embeddings through a `QueryEmbeddingBatcher`.
+
+    Notes:
+    - Text embeddings are passed straight to the wrapped model.
+    - The sync query path is meant to be called from worker threads: it hands the query to the event loop
+      and waits for its batch. Called from the event loop itself, it embeds the query directly.
+    """
+
+    _embed_model: HuggingFaceEmbedding = PrivateAttr()
+    _batcher: QueryEmbeddingBatcher = PrivateAttr()
+    _loop: asyncio.AbstractEventLoop = PrivateAttr()
+
+    def __init__(self, embed_model: HuggingFaceEmbedding, batcher: QueryEmbeddingBatcher,
+                 loop: asyncio.AbstractEventLoop, **kwargs: Any) -> None:
+        super().__init__(model_name=embed_model.model_name, embed_batch_size=embed_model.embed_batch_size, **kwargs)
+        self._embed_model = embed_model
+        self._batcher = batcher
+        self._loop = loop
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BatchedQueryEmbedding"
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        try:
+            in_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            return embed_queries(self._embed_model, [query])[0]
+        return asyncio.run_coroutine_threadsafe(self._batcher.embed(query), self._loop).result()
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._batcher.embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed_model.get_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        # Skip the `embed_batch_size` of the wrapped model, the callers batch the texts themselves
+        return self._embed_model._get_text_embeddings(texts)
+
+
+
+class RetrieveRequest(BaseModel):
+    query: str
+    collection: str = params['collections']['default']
+    top_k: Optional[int] = None
+
+
+
+class ChatRequest(BaseModel):
+    session_id: str
+    query: str
+    collection: str = params['collections']['default']
+    mode: Literal["single", "subquestion"] = "single"
+
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Load the models shared by every request when the service starts.
+
+    Notes:
+    - The blocking work of the requests (retrieval, reranking, chat, ingestion) runs on a thread pool of
+      `worker_threads`, while the event loop batches the query embeddings of all of them.
+    - A single LLM client is shared by every session, and at most `llm_concurrency` of its calls run at once
+      in every replica.
+    - The chat sessions are kept in the KV store and the locks in Redis, so any replica can answer any request.
+      With the local backend, the locks are kept in the process, as its store is not shared across nodes.
+    """
+    config = params['service']
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=config['worker_threads']))
+
+    embed_model = get_embed_model()
+    app.state.batcher = QueryEmbeddingBatcher(embed_model, config['embed_batch_size'], config['embed_batch_wait_ms'])
+    batcher_task = asyncio.create_task(app.state.batcher.run())
+
+    app.state.embed_model = BatchedQueryEmbedding(embed_model, app.state.batcher, loop)
+    app.state.llm = SlottedOpenAI(LLMSlots(config['llm_concurrency'], loop), model=config['llm_model'], max_retries=3)
+    if params['storage']['backend'] == 'local':
+        app.state.redis = None
+        app.state.locks = weakref.WeakValueDictionary()
+    else:
+        app.state.redis = Redis.from_url(get_redis_url())
+
+    yield
+
+    batcher_task.cancel()
+    app.state.batcher.shutdown()
+    if app.state.redis is not None:
+        await app.state.redis.close()
+
+
+
+app = FastAPI(title="Document Insight", lifespan=lifespan)
+
+
+
+def _node_to_dict(node: NodeWithScore) -> dict:
+    return {
+        "id": node.node.node_id,
+        "text": node.node.get_content(),
+        "metadata": node.node.metadata,
+        "score": node.score,
+    }
+
+
+
+@asynccontextmanager
+async def _lock(name: str, timeout: float) -> AsyncIterator[None]:
+    # Shared by all the replicas, and released after `timeout` seconds if its replica dies
+    if app.state.redis is None:
+        lock = app.state.locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            yield
+        return
+    async with app.state.redis.lock(f"{params['service']['lock_name']}:{name}", timeout=timeout):
+        yield
+
+
+
+def _is_portable(msg: ChatMessage) -> bool:
+    # Tool calls and their results are only meaningful within the turn that made them
+    return msg.role in (MessageRole.USER, MessageRole.ASSISTANT) and bool(msg.content) \
+        and not msg.additional_kwargs.get('tool_calls')
+
+
+
+def _save_summary(key: str, memory: SummaryBufferMemory, messages: List[ChatMessage]) -> None:
+    summary, count = memory.get_summary()
+    if count:
+        get_kvstore().put(
+            f"{key}:summary",
+            # The summary covers the first `count` messages, count them in the saved history
+            {"summary": summary, "count": sum(_is_portable(msg) for msg in messages[:count])},
+            collection=params['service']['session_store_name'],
+        )
+
+
+
+def _load_memory(key: str) -> BaseMemory:
+    sessions = params['service']['session_store_name']
+    kvstore = get_kvstore()
+    memory = get_chat_memory(app.state.llm)
+    session = kvstore.get(key, collection=sessions)
+    if session:
+        memory.set([ChatMessage(role=MessageRole(msg['role']), content=msg['content']) for msg in session['messages']])
+    summary = kvstore.get(f"{key}:summary", collection=sessions)
+    if summary and isinstance(memory, SummaryBufferMemory):
+        memory.set_summary(summary['summary'], summary['count'])
+    return memory
+
+
+
+def _save_memory(key: str, memory: BaseMemory) -> None:
+    messages = memory.get_all()
+    get_kvstore().put(
+        key,
+        {"messages": [{"role": msg.role.value, "content": msg.content} for msg in messages if _is_portable(msg)]},
+        collection=params['service']['session_store_name'],
+    )
+    if isinstance(memory, SummaryBufferMemory):
+        _save_summary(key, memory, messages)
+        # A summary still being computed is saved when it is ready
+        pending = memory.pending_summary
+        if pending is not None:
+            pending.add_done_callback(lambda _: _save_summary(key, memory, messages))
+
+
+
+def _check_collection(collection: str) -> None:
+    try:
+        validate_collection_name(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+
+def _retrieve(query_bundle: QueryBundle, collection: str, top_k: Optional[int]) -> List[NodeWithScore]:
+    retrieval_kwargs = get_retrieval_kwargs(app.state.embed_model, collection)
+    node_postprocessors = retrieval_kwargs.pop('node_postprocessors')
+    if top_k is not None:
+        retrieval_kwargs['similarity_top_k'] = top_k
+
+    retriever = VectorStoreIndex.from_vector_store(
+        get_vector_store(), embed_model=app.state.embed_model
+    ).as_retriever(**retrieval_kwargs)
+
+    nodes = retriever.retrieve(query_bundle)
+    for postprocessor in node_postprocessors:
+        nodes = postprocessor.postprocess_nodes(nodes, query_bundle=query_bundle)
+    return nodes
+
+
+
+def _ingest(files: List[CustomUploadedFile], collection: str) -> dict:
+    create_collection(collection)
+
+    report = ingest_files(files, collection)
+    if report['failed'] and not report['ingested'] and not report['skipped']:
+        raise HTTPException(status_code=500, detail={"message": "Ingestion failed.", "failed": report['failed']})
+
+    nodes = report.pop('nodes')
+    return {
+        "collection": collection,
+        "nodes": len(nodes),
+        **report,
+        "stats": update_collection_stats(collection, nodes),
+    }
+
+
+
+@app.get("/health")
+async def health() -> dict:
+    return {"status": "ok"}
+
+
+
+@app.post("/ingest")
+async def ingest(files: List[UploadFile] = File(...),
+                 collection: str = Form(params['collections']['default'])) -> dict:
+    """
+    Save, extract and ingest the uploaded files in a collection.
+
+    Notes:
+    - The files of a request overlap across the ingestion stages, see `StagedIngestion`.
+    - Ingestions of a collection run one at a time across all the replicas, so documents being deduplicated by the
+      docstore and the collection stats don't race.
+    """
+    uploads = [CustomUploadedFile(await file.read(), file.filename) for file in files]
+    async with _lock(f"ingest:{collection}", params['service']['ingest_lock_timeout']):
+        try:
+            return await asyncio.to_thread(_ingest, uploads, collection)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+
+
+@app.post("/retrieve")
+async def retrieve(request: RetrieveRequest) -> dict:
+    """
+    Return the nodes of a collection that are relevant to the query, after post-processing.
+    """
+    _check_collection(request.collection)
+    embedding = await app.state.batcher.embed(request.query)
+    query_bundle = QueryBundle(query_str=request.query, embedding=embedding)
+    nodes = await asyncio.to_thread(_retrieve, query_bundle, request.collection, request.top_k)
+    return {"nodes": [_node_to_dict(node) for node in nodes]}
+
+
+
+@app.post("/chat")
+async def chat(request: ChatRequest) -> dict:
+    """
+    Answer the query with the chat engine of the session, and return the answer, its sources and the chat history.
+
+    Notes:
+    - The chat history of every (session, collection, mode) is kept in the KV store, and a chat engine is built
+      on it for every query, so the replicas don't keep any session.
+    - The "subquestion" mode answers with one sub-question per document of the collection, see `SubQuestionChatEngine`.
+    - Queries of the same session are answered one at a time so the chat history stays consistent.
+    """
+    _check_collection(request.collection)
+    key = f"{request.session_id}:{request.collection}:{request.mode}"
+
+    async with _lock(f"session:{key}", params['service']['session_lock_timeout']):
+        memory = await asyncio.to_thread(_load_memory, key)
+        get_engine = get_subquestion_engine if request.mode == "subquestion" else get_conversation_engine
+        engine = await asyncio.to_thread(
+            get_engine, app.state.embed_model, get_vector_store(), request.collection, app.state.llm, memory
+        )
+        if request.mode == "subquestion":
+            response = await engine.achat(request.query)
+        else:
+            response = await asyncio.to_thread(engine.chat, request.query, tool_choice="query_engine_tool")
+        await asyncio.to_thread(_save_memory, key, memory)
+
+    return {
+        "response": str(response),
+        "source_nodes": [_node_to_dict(node) for node in response.source_nodes],
+        "chat_history": [{"role": msg.role.value, "content": msg.content} for msg in engine.chat_history],
+    }
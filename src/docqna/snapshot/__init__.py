@@ -0,0 +1 @@
+from .snapshot import export_snapshot, import_snapshot
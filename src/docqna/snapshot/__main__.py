@@ -0,0 +1,29 @@
+import argparse
+import json
+
+from .snapshot import export_snapshot, import_snapshot
+
+
+def main() -> None:
+    """
+    Export or import an index snapshot, e.g. from ./src:
+
+        python -m docqna.snapshot export /DocQna/store/snapshots/2024-05-01
+        python -m docqna.snapshot import /DocQna/store/snapshots/2024-05-01
+    """
+    parser = argparse.ArgumentParser(prog="python -m docqna.snapshot", description="Export or import an index snapshot.")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="The snapshot folder")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows per pipelined round-trip to Redis")
+    parser.add_argument("--no-cache", action="store_true", help="Do not export the ingestion cache")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        result = export_snapshot(args.path, batch_size=args.batch_size, include_cache=not args.no_cache)
+    else:
+        result = import_snapshot(args.path, batch_size=args.batch_size)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
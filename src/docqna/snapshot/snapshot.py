@@ -0,0 +1,246 @@
+import json
+import time
+import toml
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import redis
+
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+from ..pipeline import get_redis_url, get_vector_store
+
+
+# Get the directory of the current file and construct path to config.toml
+current_dir = Path(__file__).parent
+config_path = current_dir / '..' / '..' / '..' / 'config.toml'
+with open(config_path, 'r') as f:
+    params = toml.load(f)
+
+SNAPSHOT_VERSION = 1
+# Hash field where RedisVectorStore keeps the embedding of a node
+VECTOR_FIELD = 'vector'
+TEXT_FIELD = 'text'
+
+KV_SCHEMA = pa.schema([
+    ('hash_key', pa.string()),
+    ('field', pa.string()),
+    ('value', pa.string()),
+])
+
+
+
+def _check_backend() -> None:
+    if params['storage']['backend'] != 'redis':
+        raise ValueError(
+            f"Snapshots are only supported by the redis backend. The local backend is the folder "
+            f"'{params['storage']['local_path']}', copy it as is while no ingestion is running."
+        )
+
+
+
+def _vector_schema(dim: int) -> pa.Schema:
+    return pa.schema([
+        ('key', pa.string()),
+        ('text', pa.string()),
+        ('metadata', pa.string()),
+        ('embedding', pa.list_(pa.float32(), dim)),
+    ])
+
+
+
+def _kv_patterns() -> list[str]:
+    # Docstores of every collection, the ingestion cache, the collection registry and the near-duplicate indexes
+    return [
+        f"{params['redis']['doc_store_name']}_*",
+        params['redis']['cache_name'],
+        params['collections']['registry_name'],
+        f"{params['dedupe']['index_name']}_*",
+    ]
+
+
+
+def _scan_hashes(client: redis.Redis, pattern: str, batch_size: int) -> Iterator[list[tuple[bytes, dict]]]:
+    """
+    Yield the (key, fields) of the hashes matching the pattern, in batches read with pipelined HGETALLs.
+    """
+    keys = []
+    for key in client.scan_iter(match=pattern, count=batch_size, _type='hash'):
+        keys.append(key)
+        if len(keys) == batch_size:
+            yield _hgetall(client, keys)
+            keys = []
+    if keys:
+        yield _hgetall(client, keys)
+
+
+
+def _hgetall(client: redis.Redis, keys: list[bytes]) -> list[tuple[bytes, dict]]:
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.hgetall(key)
+    return list(zip(keys, pipe.execute()))
+
+
+
+def export_snapshot(path: str, batch_size: int = 1000, include_cache: bool = True) -> dict:
+    """
+    Export the vector index, the docstores, the ingestion cache, the collection registry and the near-duplicate
+    indexes to a snapshot folder.
+
+    Args:
+    - path (str): The folder to write the snapshot to
+    - batch_size (int): The number of hashes read per pipelined round-trip, and rows per Parquet row group
+    - include_cache (bool): Whether to export the ingestion cache
+
+    Returns:
+    - dict: The manifest of the snapshot
+
+    Notes:
+    - `vectors.parquet` holds one row per node: the embeddings as a fixed-size float32 list column (stored as one
+      contiguous array per row group), and the text and remaining hash fields as zstd-compressed columns.
+    - `kv.parquet` holds one row per (hash, field) of the KV stores.
+    - The snapshot is independent of the Redis version, unlike `dump.rdb`.
+    """
+    _check_backend()
+    t0 = time.perf_counter()
+    out = Path(path)
+    out.mkdir(parents=True, exist_ok=True)
+    client = redis.Redis.from_url(get_redis_url())
+
+    # Vectors
+    n_vectors, dim, writer = 0, None, None
+    for batch in _scan_hashes(client, f"{params['redis']['vector_index_prefix']}*", batch_size):
+        batch = [(key, fields) for key, fields in batch if VECTOR_FIELD.encode() in fields]
+        if not batch:
+            continue
+        embeddings = np.stack([np.frombuffer(fields[VECTOR_FIELD.encode()], dtype=np.float32) for _, fields in batch])
+        if writer is None:
+            dim = embeddings.shape[1]
+            writer = pq.ParquetWriter(
+                out / 'vectors.parquet', _vector_schema(dim),
+                compression={'key': 'zstd', 'text': 'zstd', 'metadata': 'zstd', 'embedding': 'none'},
+                use_dictionary=False,
+            )
+
+        texts, metadata = [], []
+        for _, fields in batch:
+            decoded = {
+                field.decode(): value.decode()
+                for field, value in fields.items() if field.decode() != VECTOR_FIELD
+            }
+            texts.append(decoded.pop(TEXT_FIELD, None))
+            metadata.append(json.dumps(decoded))
+
+        writer.write_table(pa.table({
+            'key': [key.decode() for key, _ in batch],
+            'text': texts,
+            'metadata': metadata,
+            'embedding': pa.FixedSizeListArray.from_arrays(pa.array(embeddings.ravel(), type=pa.float32()), dim),
+        }, schema=_vector_schema(dim)))
+        n_vectors += len(batch)
+    if writer is not None:
+        writer.close()
+
+    # KV stores
+    n_kv = 0
+    with pq.ParquetWriter(out / 'kv.parquet', KV_SCHEMA, compression='zstd') as kv_writer:
+        for pattern in _kv_patterns():
+            if not include_cache and pattern == params['redis']['cache_name']:
+                continue
+            for batch in _scan_hashes(client, pattern, batch_size):
+                rows = [(key.decode(), field.decode(), value.decode())
+                        for key, fields in batch for field, value in fields.items()]
+                if rows:
+                    hash_keys, fields, values = zip(*rows)
+                    kv_writer.write_table(pa.table(
+                        {'hash_key': hash_keys, 'field': fields, 'value': values}, schema=KV_SCHEMA
+                    ))
+                    n_kv += len(rows)
+
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'vector_index_name': params['redis']['vector_index_name'],
+        'vector_index_prefix': params['redis']['vector_index_prefix'],
+        'dim': dim,
+        'vectors': n_vectors,
+        'kv_entries': n_kv,
+        'seconds': round(time.perf_counter() - t0, 2),
+    }
+    (out / 'manifest.json').write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+
+def import_snapshot(path: str, batch_size: int = 1000) -> dict:
+    """
+    Bulk-load a snapshot folder written by `export_snapshot` into the configured Redis server.
+
+    Args:
+    - path (str): The snapshot folder
+    - batch_size (int): The number of rows written per pipelined round-trip
+
+    Returns:
+    - dict: The number of vectors and KV entries loaded, and the time it took
+
+    Notes:
+    - The first node goes through `RedisVectorStore.add`, so the vector index is created with the same schema
+      as a normal ingestion. Every row is then written with pipelined HSETs and indexed by Redis as it lands.
+    - Existing keys are overwritten, so importing the same snapshot twice is harmless.
+    """
+    _check_backend()
+    t0 = time.perf_counter()
+    src = Path(path)
+    manifest = json.loads((src / 'manifest.json').read_text())
+    if manifest['version'] != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {manifest['version']}.")
+    if manifest['vector_index_prefix'] != params['redis']['vector_index_prefix']:
+        raise ValueError(
+            f"The snapshot was exported from '{manifest['vector_index_prefix']}', "
+            f"the config uses '{params['redis']['vector_index_prefix']}'."
+        )
+
+    client = redis.Redis.from_url(get_redis_url())
+
+    n_vectors = 0
+    if manifest['vectors']:
+        index_created = False
+        for batch in pq.ParquetFile(src / 'vectors.parquet').iter_batches(batch_size=batch_size):
+            keys = batch.column('key').to_pylist()
+            texts = batch.column('text').to_pylist()
+            metadata = [json.loads(fields) for fields in batch.column('metadata').to_pylist()]
+            embeddings = batch.column('embedding').flatten().to_numpy().reshape(len(keys), manifest['dim'])
+
+            if not index_created:
+                node = metadata_dict_to_node(metadata[0], text=texts[0])
+                node.embedding = embeddings[0].tolist()
+                get_vector_store().add([node])
+                index_created = True
+
+            pipe = client.pipeline(transaction=False)
+            for key, text, fields, embedding in zip(keys, texts, metadata, embeddings):
+                mapping = {**fields, VECTOR_FIELD: embedding.astype(np.float32).tobytes()}
+                if text is not None:
+                    mapping[TEXT_FIELD] = text
+                pipe.hset(key, mapping=mapping)
+            pipe.execute()
+            n_vectors += len(keys)
+
+    n_kv = 0
+    for batch in pq.ParquetFile(src / 'kv.parquet').iter_batches(batch_size=batch_size):
+        pipe = client.pipeline(transaction=False)
+        for hash_key, field, value in zip(*(batch.column(name).to_pylist() for name in KV_SCHEMA.names)):
+            pipe.hset(hash_key, field, value)
+        pipe.execute()
+        n_kv += batch.num_rows
+
+    return {
+        'vectors': n_vectors,
+        'kv_entries': n_kv,
+        'seconds': round(time.perf_counter() - t0, 2),
+    }
@@ -1 +1 @@
-from .stcomp import initialize_session_state, file_processing, handle_user_input
+from .stcomp import initialize_session_state, file_processing, handle_user_input, select_collection, select_query_mode
@@ -1,12 +1,9 @@
 # Standard Libraries
 from time import perf_counter
-from typing import Any
-import copy
+from typing import Any, Optional
 import os
 import hashlib
 import time
-import subprocess
-import io
 import toml
 from pathlib import Path
 
@@ -14,7 +11,6 @@ from pathlib import Path
 import streamlit as st
 import nltk
 from docx import Document
-from fpdf import FPDF
 try:
     nltk.download('punkt_tab')
 except:
@@ -23,21 +19,22 @@ except:
 
 # Module Imports
 from ..chat import get_conversation_engine
-from ..pipeline import get_pipeline
-from ..pdf_ingest import get_pdf_text, get_pdf_text_ocr, get_text_nodes
+from ..subquestion import get_subquestion_engine
+from ..pipeline import get_embed_model, get_vector_store
+from ..collection import (
+    list_collections, create_collection, get_collection_stats, update_collection_stats
+)
+from ..pdf_ingest import get_page_num, format_dedupe_stats
+from ..ingest import ingest_files
 from ..HTMLTemplates import bot_template, user_template
 from ..display_image import show_image
 from ..context import get_context
+from ..service import ServiceClient
 from nltk.tokenize import sent_tokenize
 
 # Testing
 import re
 
-# Initialising pipeline and embed model
-pipeline = get_pipeline()['pipeline']
-embed_model = get_pipeline()['embed_model']
-
-
 # Get the directory of the current file and construct path to config.toml
 current_dir = Path(__file__).parent
 config_path = current_dir / '..' / '..' / '..' / 'config.toml'
@@ -46,22 +43,20 @@ with open(config_path, 'r') as f:
 # Create the directories if they dont exist
 data_path = params['paths']['data_path']
 os.makedirs(data_path, exist_ok=True)
-dir_path = data_path
 
+# Query modes selectable in the sidebar
+QUERY_MODES = {
+    "single": "Single search",
+    "subquestion": "Sub-questions per document",
+}
 
+# URL of the query/ingest service, the models run in the app process if it is empty
+service_url = os.environ.get('DOCQNA_SERVICE_URL', params['service']['url'])
 
-class CustomUploadedFile(io.BytesIO):
-    def __init__(self, data, name):
-        super().__init__(data)
-        self.name = name
-
-    def __repr__(self):
-        return f"CustomUploadedFile(name={self.name}, size={len(self.getvalue())})"
-    
-
-
-def convert_docx_to_pdf(input_file, output_file):
-    subprocess.run(["pandoc", "-o", output_file, input_file])
+# Initialising embed model and the vector store shared by all the collections
+if not service_url:
+    embed_model = get_embed_model()
+    vector_store = get_vector_store()
 
 
 
@@ -74,42 +69,18 @@ def split_into_sentences(text):
 
 
 
-# Function to save the uploaded file
-def save_uploaded_file(uploaded_file):
-    try:
-        # Create the directory if it doesn't exist
-        os.makedirs(dir_path, exist_ok=True)
-        
-        # Save the file to the specified directory
-        file_path = os.path.join(dir_path, uploaded_file.name)
-        with open(file_path, 'wb') as f:
-            f.write(uploaded_file.getbuffer())
-    except Exception as e:
-        st.error(f'Error saving file: {e}')
-
-
-
-
-
-def txt_to_pdf(txt_file_path, pdf_file_path):
-    # Create a new PDF object
-    pdf = FPDF()
-    # Open the text file for reading
-    with open(txt_file_path, 'r', encoding='latin-1') as txt_file:
-        # Get the content of the text file
-        txt_content = txt_file.read()
-    # Split the text content into lines
-    lines = txt_content.splitlines()
-    # Add a new page to the PDF
-    pdf.add_page()
-    # Set the font and font size
-    pdf.set_font('Arial', size=12)
-    # Loop through the lines and add them to the PDF
-    for line in lines:
-        pdf.cell(w=200, h=10, txt=line, ln=1, align='L') # type: ignore
-    # Save the PDF
-    pdf.output(pdf_file_path)
+def new_conversation(collection: str, mode: str = "single") -> Any:
+    """
+    Return a new conversation on a collection: a client of the service if one is configured, a local chat engine otherwise.
 
+    Notes:
+    - The "subquestion" mode splits the questions spanning several documents into one sub-question per document.
+    """
+    if service_url:
+        return ServiceClient(service_url, collection, mode=mode)
+    if mode == "subquestion":
+        return get_subquestion_engine(embed_model, vector_store, collection)
+    return get_conversation_engine(embed_model, vector_store, collection)
 
 
 
@@ -120,17 +91,94 @@ def initialize_session_state():
 
 
     Notes:
-    - Initializes the conversation chain, documents processed flag, and chat history in the session state.
+    - Initializes the selected collection, query mode, conversation chain, documents processed flag, chat history and the pages asked for in full resolution in the session state.
     - It checks if the session state variable already exists before initializing to avoid overwriting.
     """
+    if "collection" not in st.session_state:
+        st.session_state.collection = params['collections']['default']
+    if "query_mode" not in st.session_state:
+        st.session_state.query_mode = params['subquestion']['default_mode']
     if "conversation" not in st.session_state:
-        st.session_state.conversation = get_conversation_engine(embed_model, pipeline.vector_store)
+        st.session_state.conversation = new_conversation(st.session_state.collection, st.session_state.query_mode)
     if "documents_processed" not in st.session_state:
         st.session_state.documents_processed = False
     if "chat_history" not in st.session_state:
         st.session_state.chat_history = None
+    if "full_pages" not in st.session_state:
+        st.session_state.full_pages = set()
+
+
 
 
+def switch_collection() -> None:
+    """
+    Start a new conversation on the collection and with the query mode selected in the sidebar.
+    """
+    st.session_state.conversation = new_conversation(st.session_state.collection, st.session_state.query_mode)
+    st.session_state.chat_history = None
+    st.session_state.documents_processed = False
+
+
+
+def add_collection() -> None:
+    """
+    Create the collection typed in the sidebar and switch to it.
+    """
+    name = st.session_state.new_collection.strip()
+    try:
+        create_collection(name)
+    except ValueError as e:
+        st.session_state.collection_error = str(e)
+        return
+    st.session_state.collection = name
+    st.session_state.new_collection = ""
+    switch_collection()
+
+
+
+def select_collection() -> None:
+    """
+    Display the collection selector, the form to create a collection and the stats of the selected collection.
+
+    Notes:
+    - Ingestion and retrieval only apply to the selected collection.
+    - Changing the collection starts a new conversation.
+    """
+    st.selectbox(
+        label="Collection:",
+        options=list_collections(),
+        key="collection",
+        on_change=switch_collection,
+    )
+    st.text_input(label="New collection:", key="new_collection", on_change=add_collection)
+    if "collection_error" in st.session_state:
+        st.error(st.session_state.pop("collection_error"))
+
+    stats = get_collection_stats(st.session_state.collection)
+    st.caption(
+        f"{stats['documents']:,} documents, {stats['nodes']:,} nodes"
+        + (f" (updated {stats['updated']})" if stats['updated'] else "")
+    )
+
+
+
+def select_query_mode() -> None:
+    """
+    Display the query mode toggle.
+
+    Notes:
+    - "Sub-questions per document" answers comparative questions ("how does the 2019 survey differ from the 2021 one")
+      with concurrent retrievals on each document, at the cost of two more LLM calls per question.
+    - Changing the mode starts a new conversation.
+    """
+    st.radio(
+        label="Query mode:",
+        options=list(QUERY_MODES),
+        format_func=QUERY_MODES.get,
+        key="query_mode",
+        on_change=switch_collection,
+    )
+
 
 
 def file_processing(files: list[Any]) -> None:
@@ -141,6 +189,8 @@ def file_processing(files: list[Any]) -> None:
     - files (list[Any]): A list of uploaded PDF files to be processed.
  
     Notes:
+    - The documents are ingested in the collection selected in the session state.
+    - The files are saved, extracted, split, embedded and stored by concurrent stages, see `StagedIngestion`.
     - The function provides user feedback using Streamlit's info and spinner functionalities.
     - It updates the session state to indicate that documents have been processed.
     - Passes PDFs for performing OCR on them if they dont contain any text.
@@ -149,78 +199,60 @@ def file_processing(files: list[Any]) -> None:
     try:
         # While Everything is being processed run the spinner
         with st.spinner("Processing your documents..."):
-            copy_files = copy.deepcopy(files)
-            # Initialise documents to store all the Documents in the list
-            documents = []
-
-
-            
-
-            # Loop across every file that has been uploaded
-            for i,file in enumerate(files):
-                if file.name.endswith(".pdf") :
-                    save_uploaded_file(file)
-                    document_list = get_pdf_text(file)
-                    # Check if document contains an error
-                    # Fallback to OCR if extracting text from PDF fails
-                    if document_list[0].text == 'Error':
-                        st.warning("Error extracting text from PDFs using the first method. Trying OCR...")
-                        document_list = get_pdf_text_ocr(copy_files[i])
-                    
-                    # documents.extend(document_list)
-                
-                elif file.name.endswith(".docx"):
-                    docx_file = file
-                    docx_path = os.path.join(data_path, docx_file.name)
-                    pdf_path = os.path.join(data_path, os.path.splitext(docx_file.name)[0] + ".pdf")
-                    
-                    # Save the docx file
-                    with open(docx_path, "wb") as f:
-                        f.write(docx_file.read())
-                        # Convert the docx file to pdf
-                        convert_docx_to_pdf(docx_path, pdf_path)
-
-                        # Read the PDF file
-                        if os.path.exists(pdf_path):
-                            with open(pdf_path, "rb") as f:
-                                pdf_bytes = f.read()
-                            uploaded_file = CustomUploadedFile(pdf_bytes, os.path.splitext(docx_file.name)[0] + ".pdf")
-                            document_list = get_pdf_text(uploaded_file)  
-                        else:
-                            st.write(f"PDF file {os.path.basename(pdf_path)} not found.")
-
-
-                                
-                elif file.name.endswith(".txt"):
-                    txt_file = file
-                    txt_path = os.path.join(data_path, txt_file.name)
-                    pdf_path = os.path.join(data_path, os.path.splitext(txt_file.name)[0] + ".pdf")
-                    # Save the txt file
-                    with open(txt_path, "wb") as f:
-                        f.write(txt_file.read())
-                    # Convert the txt file to pdf
-                    txt_to_pdf(txt_path, pdf_path)
-                    # Read the PDF file
-                    if os.path.exists(pdf_path):
-                        with open(pdf_path, "rb") as f:
-                            pdf_bytes = f.read()
-                        uploaded_file = CustomUploadedFile(pdf_bytes, os.path.splitext(txt_file.name)[0] + ".pdf")
-                        document_list = get_pdf_text(uploaded_file)
-                    else:
-                        st.write(f"PDF file {os.path.basename(pdf_path)} not found.")
-
-                # Append all the extracted pages in main document list
-                documents.extend(document_list)
-            
-            st.info(
-                f"Document processing completed."
-            ) 
-            
-            # Initialise performance counter time
-            t0 = perf_counter()
-            # Get text nodes
-            nodes = get_text_nodes(documents, pipeline)
-            t_delta = (perf_counter() - t0) / 60
+            collection = st.session_state.collection
+
+            if service_url:
+                # The service saves, extracts and ingests the files, and updates the collection stats
+                t0 = perf_counter()
+                result = st.session_state.conversation.ingest(files)
+                t_delta = (perf_counter() - t0) / 60
+                st.info(
+                    f"Number of Nodes Ingested: {result['nodes']:,}"
+                )
+                nodes = []
+            else:
+                # Ingest the files through the save, extract, split, embed and store stages
+                progress = st.progress(0.0, text="Ingesting your documents...")
+                finished = set()
+
+                def on_event(event: dict) -> None:
+                    # Called in the script thread, the stage workers never call Streamlit
+                    if event['status'] == 'warning':
+                        st.warning(f"{event['file']}: {event['message']}")
+                    elif event['status'] == 'skipped':
+                        st.info(f"{event['file']}: {event['message']}")
+                    elif event['status'] == 'failed':
+                        st.error(f"{event['file']} failed at the {event['stage']} stage: {event['message']}")
+                    if event['status'] in ('done', 'skipped', 'failed'):
+                        finished.add(event['file'])
+                        progress.progress(len(finished) / len(files), text=f"{len(finished)}/{len(files)} files")
+
+                # Initialise performance counter time
+                t0 = perf_counter()
+                report = ingest_files(files, collection, on_event)
+                t_delta = (perf_counter() - t0) / 60
+
+                nodes = report['nodes']
+                if report['failed'] and not report['ingested'] and not report['skipped']:
+                    # Every file failed
+                    nodes = None
+                else:
+                    st.info(
+                        f"Number of Nodes Ingested: {len(nodes):,}"
+                    )
+                    if report.get('embed_cache') and sum(report['embed_cache'].values()):
+                        hits, misses = report['embed_cache']['hits'], report['embed_cache']['misses']
+                        st.info(
+                            f"Embedding cache: {hits:,} hits, {misses:,} computed ({hits / (hits + misses):.0%} hit ratio)"
+                        )
+                    if report.get('dedupe') and any(report['dedupe'].values()):
+                        st.info(format_dedupe_stats(report['dedupe']))
+                    st.caption(
+                        "Busy time per stage: "
+                        + ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in report['stage_seconds'].items())
+                    )
+                    # Update the stats of the collection
+                    update_collection_stats(collection, nodes)
 
             #  if Every thing moves smoothly Update session state
             if nodes is not None:
@@ -239,22 +271,25 @@ def file_processing(files: list[Any]) -> None:
 
 
 
-def get_page_num(text: str):
-    # Regular expression pattern to find page number references
-    pattern = r'PAGE_NUM=(\d+)'
-
-    # Find all matches of the pattern in the text
-    matches = re.findall(pattern, text)
-
-    # Use a set to store unique page numbers
-    unique_page_numbers = set()
-
-    # Extract the numbers from the matches and store them in a set to ensure uniqueness
-    for match in matches:
-        unique_page_numbers.add(int(match))
-
-    return list(unique_page_numbers)
+def download_page(path: str, page_num: int, file_hash: Optional[str], key: str) -> None:
+    """
+    Show the download button of the full resolution image of a page, once the user asked for it.
 
+    Notes:
+    - The full resolution image is only loaded after a click on "Full Resolution", so answering a question
+      doesn't load a large image for every page of every source node. The pages asked for are kept in the
+      session state, so their download buttons stay across reruns.
+    """
+    if st.button(label="Full Resolution🔍", key=key + "_full") or key in st.session_state.full_pages:
+        st.session_state.full_pages.add(key)
+        full_image, file_name, mime = show_image(path, page_num, size="full", file_hash=file_hash)
+        st.download_button(
+            label="Download Page⬇️",
+            data=full_image,
+            file_name=file_name,
+            mime=mime,
+            key=key
+        )
 
 
 
@@ -326,17 +361,10 @@ def handle_user_input(user_query: str) -> None:
                                 st.error('NO PAGE NUM FOUND')
                             for page_idx, page_num in enumerate(page_nums):
                                 st.write('PAGE_NUM found:' + str(page_num))
-                                images,image_path = show_image(path,page_num)
-                                st.image(images, caption=f"Page {page_num}", use_column_width=True)
-                                with open(image_path, "rb") as file:
-                                    key = hashlib.sha256((image_path + str(idx) + str(node_idx) + str(page_idx) + str(page_num) + "_tab3_long" + user_query).encode()).hexdigest() 
-                                    st.download_button(
-                                        label="Download Page⬇️",
-                                        data=file,
-                                        file_name=image_path,
-                                        mime="image/png",
-                                        key=key
-                                    )
+                                image, file_name, mime = show_image(path,page_num,file_hash=node.metadata.get('file_hash'))
+                                st.image(image, caption=f"Page {page_num}", use_column_width=True)
+                                key = hashlib.sha256((file_name + str(idx) + str(node_idx) + str(page_idx) + str(page_num) + "_tab3_long" + user_query).encode()).hexdigest() 
+                                download_page(path, page_num, node.metadata.get('file_hash'), key)
                     break
             else:
                 st.write(
@@ -373,17 +401,10 @@ def handle_user_input(user_query: str) -> None:
                                 st.error('NO PAGE NUM FOUND')
                             for page_idx, page_num in enumerate(page_nums):
                                 st.write('PAGE_NUM found:' + str(page_num))
-                                images,image_path = show_image(path,page_num)
-                                st.image(images, caption=f"Page {page_num}", use_column_width=True)
-                                with open(image_path, "rb") as file:
-                                    key = hashlib.sha256((image_path + str(idx) + str(node_idx) + str(page_idx) + str(page_num) + "_tab2_short" + user_query).encode()).hexdigest() 
-                                    st.download_button(
-                                        label="Download Page⬇️",
-                                        data=file,
-                                        file_name=image_path,
-                                        mime="image/png",
-                                        key=key
-                                    )               
+                                image, file_name, mime = show_image(path,page_num,file_hash=node.metadata.get('file_hash'))
+                                st.image(image, caption=f"Page {page_num}", use_column_width=True)
+                                key = hashlib.sha256((file_name + str(idx) + str(node_idx) + str(page_idx) + str(page_num) + "_tab2_short" + user_query).encode()).hexdigest() 
+                                download_page(path, page_num, node.metadata.get('file_hash'), key)               
         elif msg.role.name == 'USER':
             # Adding styles to Chat Boxes and messages
             st.write(
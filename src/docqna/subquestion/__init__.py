@@ -0,0 +1 @@
+from .subquestion import SubQuestionChatEngine, get_subquestion_engine
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import toml
+from pathlib import Path
+from typing import List, Optional
+
+from llama_index.core import Settings, VectorStoreIndex, get_response_synthesizer
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.chat_engine.types import AgentChatResponse
+from llama_index.core.llms import LLM, ChatMessage, MessageRole
+from llama_index.core.memory.types import BaseMemory
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.types import BasePydanticVectorStore
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+from ..chat import get_retrieval_kwargs
+from ..collection import get_collection_filters, get_collection_stats
+from ..memory import get_chat_memory
+from ..pipeline import embed_queries
+
+
+# Get the directory of the current file and construct path to config.toml
+current_dir = Path(__file__).parent
+config_path = current_dir / '..' / '..' / '..' / 'config.toml'
+with open(config_path, 'r') as f:
+    params = toml.load(f)
+
+DECOMPOSE_PROMPT = (
+    "You answer questions over a collection of documents. If the question compares or spans several of the "
+    "documents below, split it into self-contained sub-questions, each answered from a single document. "
+    "Otherwise, return a single sub-question with a null source: the question rewritten to stand on its own "
+    "given the conversation.\n\n"
+    "Documents:\n{sources}\n\n"
+    "Conversation so far:\n{history}\n\n"
+    "Question: {question}\n\n"
+    "Return only a JSON list of at most {max_sub_questions} objects with the keys \"source\" (a document name "
+    "from the list, or null) and \"question\"."
+)
+
+SYNTHESIS_PROMPT = (
+    "Answer the question using the answers to its sub-questions below. Compare the documents where the question "
+    "asks for it, and name the document every fact comes from.\n\n"
+    "Sub-questions and answers:\n{answers}\n\n"
+    "Question: {question}\n"
+    "Answer:"
+)
+
+
+
+class SubQuestionChatEngine:
+    """
+    Chat engine that answers questions spanning several documents of a collection with one sub-question per document.
+
+    Notes:
+    - The LLM decomposes the question into sub-questions on the source files of the collection, using the
+      chat history to resolve follow-ups. Questions about a single topic stay a single, collection-wide search.
+    - The sub-questions are embedded in a single batch, then their filtered retrievals and partial answers run
+      concurrently, at most `concurrency` at once. The partial answers are then synthesized into one answer, so
+      the wall-clock time is close to a single query plus the decomposition and synthesis calls.
+    - `chat` and `chat_history` mirror the Llama Index chat engine, so the UI and the service handle both the same way.
+    - `achat` runs on the caller's event loop. `chat` runs it with `asyncio.run` and makes the LLM calls with the sync
+      client in worker threads, as the async clients stay bound to the loop they were first used in.
+    - The LLM calls are not limited here: the service passes an LLM that holds one of its slots per call.
+    """
+
+    def __init__(self, embed_model: BaseEmbedding, vector_store: BasePydanticVectorStore, collection: str,
+                 llm: Optional[LLM] = None, memory: Optional[BaseMemory] = None) -> None:
+        self.collection = collection
+        self._embed_model = embed_model
+        self._llm = llm or Settings.llm
+        self._index = VectorStoreIndex.from_vector_store(vector_store, embed_model=embed_model)
+        self._synthesizer = get_response_synthesizer(llm=self._llm)
+        self._memory = memory or get_chat_memory(llm)
+        self._config = params['subquestion']
+
+    @property
+    def chat_history(self) -> List[ChatMessage]:
+        return self._memory.get_all()
+
+    def reset(self) -> None:
+        self._memory.reset()
+
+    async def _complete(self, prompt: str, blocking: bool) -> str:
+        if blocking:
+            return (await asyncio.to_thread(self._llm.complete, prompt)).text
+        return (await self._llm.acomplete(prompt)).text
+
+    async def _decompose(self, question: str, blocking: bool) -> List[dict]:
+        sources = (await asyncio.to_thread(get_collection_stats, self.collection))['sources']
+        if len(sources) < 2:
+            sources = []
+        history = "\n".join(
+            f"{msg.role.value}: {msg.content}" for msg in self._memory.get() if msg.content
+        ) or "(none)"
+
+        prompt = DECOMPOSE_PROMPT.format(
+            sources="\n".join(f"- {source}" for source in sources) or "(a single document)",
+            history=history,
+            question=question,
+            max_sub_questions=self._config['max_sub_questions'],
+        )
+        text = await self._complete(prompt, blocking)
+        try:
+            sub_questions = json.loads(text[text.index('['):text.rindex(']') + 1])
+        except ValueError:
+            sub_questions = []
+
+        # Drop the sources the LLM made up, and the duplicates
+        valid, seen = [], set()
+        for sub_question in sub_questions:
+            if not isinstance(sub_question, dict) or not sub_question.get('question'):
+                continue
+            source = sub_question.get('source')
+            source = source if source in sources else None
+            if (source, sub_question['question']) not in seen:
+                seen.add((source, sub_question['question']))
+                valid.append({'source': source, 'question': sub_question['question']})
+        return valid[:self._config['max_sub_questions']] or [{'source': None, 'question': question}]
+
+    async def _embed(self, questions: List[str]) -> List[List[float]]:
+        if isinstance(self._embed_model, HuggingFaceEmbedding):
+            # One forward pass for all the sub-questions
+            return await asyncio.to_thread(embed_queries, self._embed_model, questions)
+        return list(await asyncio.gather(*(self._embed_model.aget_query_embedding(q) for q in questions)))
+
+    def _retrieve(self, query_bundle: QueryBundle, source: Optional[str]) -> List[NodeWithScore]:
+        retrieval_kwargs = get_retrieval_kwargs(self._embed_model, self.collection)
+        node_postprocessors = retrieval_kwargs.pop('node_postprocessors')
+        retrieval_kwargs['filters'] = get_collection_filters(self.collection, source)
+
+        nodes = self._index.as_retriever(**retrieval_kwargs).retrieve(query_bundle)
+        for postprocessor in node_postprocessors:
+            nodes = postprocessor.postprocess_nodes(nodes, query_bundle=query_bundle)
+        return nodes
+
+    async def _answer(self, sub_question: dict, embedding: List[float], slots: asyncio.Semaphore,
+                      blocking: bool) -> tuple:
+        query_bundle = QueryBundle(query_str=sub_question['question'], embedding=embedding)
+        async with slots:
+            nodes = await asyncio.to_thread(self._retrieve, query_bundle, sub_question['source'])
+            if blocking:
+                response = await asyncio.to_thread(self._synthesizer.synthesize, sub_question['question'], nodes)
+            else:
+                response = await self._synthesizer.asynthesize(sub_question['question'], nodes)
+        return str(response), nodes
+
+    async def _chat(self, query: str, blocking: bool) -> AgentChatResponse:
+        sub_questions = await self._decompose(query, blocking)
+        embeddings = await self._embed([sub_question['question'] for sub_question in sub_questions])
+
+        slots = asyncio.Semaphore(self._config['concurrency'])
+        results = await asyncio.gather(*(
+            self._answer(sub_question, embedding, slots, blocking)
+            for sub_question, embedding in zip(sub_questions, embeddings)
+        ))
+
+        if len(results) == 1:
+            answer = results[0][0]
+        else:
+            answers = "\n\n".join(
+                f"[{sub_question['source'] or 'all documents'}] {sub_question['question']}\n{partial}"
+                for sub_question, (partial, _) in zip(sub_questions, results)
+            )
+            answer = await self._complete(SYNTHESIS_PROMPT.format(answers=answers, question=query), blocking)
+
+        self._memory.put(ChatMessage(role=MessageRole.USER, content=query))
+        self._memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=answer))
+        return AgentChatResponse(response=answer, source_nodes=[node for _, nodes in results for node in nodes])
+
+    async def achat(self, query: str, tool_choice: Optional[str] = None) -> AgentChatResponse:
+        # The engine always retrieves, so the tool choice is ignored
+        return await self._chat(query, blocking=False)
+
+    def chat(self, query: str, tool_choice: Optional[str] = None) -> AgentChatResponse:
+        return asyncio.run(self._chat(query, blocking=True))
+
+
+
+def get_subquestion_engine(embed_model: BaseEmbedding, vector_store: BasePydanticVectorStore, collection: str,
+                           llm: Optional[LLM] = None, memory: Optional[BaseMemory] = None) -> SubQuestionChatEngine:
+    """
+    Initialize and return a sub-question chat engine on a collection, see `SubQuestionChatEngine`.
+    """
+    return SubQuestionChatEngine(embed_model, vector_store, collection, llm, memory)